@@ -0,0 +1,247 @@
+"""Benchmarks für die Abrufpfade der KVV-API.
+
+Ein lokaler aiohttp-Server liefert die Antworten aus ``fixtures.py`` für die
+Szenarien small, busy_hub und large aus, dazu captured mit echten
+EFA-Antworten, falls aufgezeichnet. Gemessen werden Latenz (Median, p95),
+allozierte Speicherblöcke und Spitzenspeicher je Aufruf von
+get_points_by_name, get_departures_by_station_id (ungefiltert und gefiltert)
+und get_serving_lines sowie je vollständigem Coordinator-Zyklus.
+
+Benötigt eine Umgebung mit Home Assistant (wie für die Integration selbst):
+
+    python benchmarks/bench_api.py                    # messen und vergleichen
+    python benchmarks/bench_api.py --update-baseline  # baseline.json schreiben
+
+Liegt ein Wert um mehr als die Toleranz über baseline.json, endet das Skript
+mit Exit-Code 1. Fehlt baseline.json, gibt es nur eine Warnung.
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from types import SimpleNamespace
+
+from aiohttp import ClientSession, web
+
+import fixtures
+
+ROOT = Path(__file__).resolve().parent
+sys.path.insert(0, str(ROOT.parent / "custom_components"))
+
+from kvv_departure_monitor.api import KVVApi  # noqa: E402
+from kvv_departure_monitor.scheduler import KVVRequestScheduler  # noqa: E402
+
+BASELINE = ROOT / "baseline.json"
+
+
+async def start_server(payloads: dict) -> tuple[web.AppRunner, str]:
+    """Startet den Stand-in-Server auf einem freien Port."""
+
+    async def handle(request: web.Request) -> web.Response:
+        scenario = payloads[request.match_info["scenario"]]
+        return web.Response(
+            body=scenario[request.match_info["endpoint"]],
+            content_type="application/json",
+        )
+
+    app = web.Application()
+    app.router.add_get("/{scenario}/{endpoint}", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+def make_api(session: ClientSession, base: str, scenario: str) -> KVVApi:
+    """API ohne Drosselung, deren URLs auf den Stand-in-Server zeigen."""
+    api = KVVApi(None, session=session)
+    api.BASE_URL = f"{base}/{scenario}/stopfinder"
+    api.DEPARTURE_URL = f"{base}/{scenario}/dm"
+    return api
+
+
+async def measure(call, iterations: int) -> dict:
+    """Latenz über `iterations` Läufe, Speicher über einen separaten Lauf."""
+    await call()  # Aufwärmen (Verbindungsaufbau, Imports)
+
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        await call()
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+    base_current, _ = tracemalloc.get_traced_memory()
+    await call()
+    _, peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    allocations = sum(
+        stat.count_diff
+        for stat in after.compare_to(before, "filename")
+        if stat.count_diff > 0
+    )
+
+    latencies.sort()
+    return {
+        "median_ms": round(statistics.median(latencies), 3),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1], 3),
+        "allocations": allocations,
+        "peak_kib": round((peak - base_current) / 1024, 1),
+    }
+
+
+async def bench_api(session, base, scenario, iterations) -> dict:
+    """Einzelaufrufe der API; der Antwort-Cache wird vor jedem Lauf geleert."""
+    deps, lines = fixtures.scenario_setup(scenario)
+    api = make_api(session, base, scenario)
+
+    def uncached(coro_factory):
+        async def _call():
+            api._cache.clear()
+            return await coro_factory()
+
+        return _call
+
+    results = {
+        "get_points_by_name": await measure(
+            uncached(lambda: api.get_points_by_name("Karlsruhe")), iterations
+        ),
+        "get_departures": await measure(
+            uncached(lambda: api.get_departures_by_station_id("1", limit=deps)),
+            iterations,
+        ),
+        "get_serving_lines": await measure(
+            uncached(lambda: api.get_serving_lines("1")), iterations
+        ),
+    }
+
+    filtered = uncached(
+        lambda: api.get_departures_by_station_id("1", limit=10, allowed_lines=lines)
+    )
+    results["get_departures_filtered"] = await measure(filtered, iterations)
+    return results
+
+
+async def bench_coordinator(session, base, scenario, iterations) -> dict:
+    """Ein vollständiger Refresh-Zyklus eines Haltestellen-Coordinators."""
+    # Erst hier, damit die API-Benchmarks ohne Coordinator-Abhängigkeiten laufen
+    from homeassistant.core import HomeAssistant
+    from kvv_departure_monitor.coordinator import KVVDataCoordinator
+
+    _, lines = fixtures.scenario_setup(scenario)
+    with tempfile.TemporaryDirectory() as config_dir:
+        hass = HomeAssistant(config_dir)
+        api = make_api(session, base, scenario)
+        coordinator = KVVDataCoordinator(
+            hass,
+            api,
+            KVVRequestScheduler(rate=1e9, burst=10**9),
+            api.metrics,
+            "1",
+        )
+        coordinator.add_subscriber(
+            SimpleNamespace(
+                entry_id="bench",
+                data={"serving_lines": lines},
+                options={"departure_limit": 10},
+            )
+        )
+
+        async def _cycle():
+            api._cache.clear()
+            await coordinator.async_refresh()
+
+        try:
+            return {"coordinator_cycle": await measure(_cycle, iterations)}
+        finally:
+            await coordinator.async_shutdown()
+            await hass.async_stop(force=True)
+
+
+def compare(results: dict, baseline: dict, latency_tol: float, memory_tol: float):
+    """Liefert die Liste der Regressionen gegenüber der Baseline."""
+    regressions = []
+    for scenario, calls in results.items():
+        for call, values in calls.items():
+            reference = baseline.get(scenario, {}).get(call)
+            if reference is None:
+                continue
+            for key, tolerance in (
+                ("median_ms", latency_tol),
+                ("peak_kib", memory_tol),
+                ("allocations", memory_tol),
+            ):
+                if values[key] > reference[key] * (1 + tolerance):
+                    regressions.append(
+                        f"{scenario}/{call} {key}: {values[key]} > {reference[key]}"
+                    )
+    return regressions
+
+
+async def main(args) -> int:
+    runner, base = await start_server(fixtures.payloads())
+    results = {}
+    try:
+        async with ClientSession() as session:
+            for scenario in fixtures.scenarios():
+                results[scenario] = await bench_api(
+                    session, base, scenario, args.iterations
+                )
+                results[scenario].update(
+                    await bench_coordinator(session, base, scenario, args.iterations)
+                )
+    finally:
+        await runner.cleanup()
+
+    for scenario, calls in results.items():
+        print(f"\n{scenario}")
+        for call, values in calls.items():
+            print(
+                f"  {call:32} {values['median_ms']:9.3f} ms  "
+                f"p95 {values['p95_ms']:9.3f} ms  "
+                f"{values['allocations']:7d} allocs  {values['peak_kib']:9.1f} KiB"
+            )
+
+    if args.update_baseline:
+        BASELINE.write_text(json.dumps(results, indent=2) + "\n")
+        print(f"\nBaseline gespeichert: {BASELINE}")
+        return 0
+
+    if not BASELINE.exists():
+        # Bis eine Baseline eingecheckt ist, nur warnen
+        print(
+            "\nWARNUNG: keine baseline.json vorhanden, Vergleich übersprungen; "
+            "mit --update-baseline anlegen",
+            file=sys.stderr,
+        )
+        return 0
+
+    regressions = compare(
+        results,
+        json.loads(BASELINE.read_text()),
+        args.latency_tolerance,
+        args.memory_tolerance,
+    )
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--latency-tolerance", type=float, default=0.25)
+    parser.add_argument("--memory-tolerance", type=float, default=0.10)
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,292 @@
+"""Erzeugt EFA-artige Antworten für die Benchmarks.
+
+Aufbau und Feldnamen folgen den Antworten von XSLT_DM_REQUEST und
+XSLT_STOPFINDER_REQUEST, soweit die Integration sie liest, ergänzt um die
+übrigen Felder, die die EFA pro Eintrag mitliefert (Koordinaten, Operator,
+Attribute, ...). Die Erzeugung ist deterministisch, damit Messungen
+vergleichbar bleiben.
+
+Dazu kommt das Szenario captured mit echten, aufgezeichneten Antworten aus
+``captured/``, sobald diese vorliegen:
+
+    python benchmarks/fixtures.py --capture 7000090 Karlsruhe
+"""
+
+import argparse
+import asyncio
+import json
+import random
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# Name → (Anzahl Abfahrten, Anzahl Linien, Anzahl Stopfinder-Treffer)
+SCENARIOS = {
+    "small": (10, 4, 5),
+    "busy_hub": (60, 24, 20),
+    "large": (400, 40, 60),
+}
+
+STATION_ID = "7000090"
+START = datetime(2025, 9, 5, 10, 0)
+
+# Aufgezeichnete EFA-Antworten (dm.json, stopfinder.json)
+CAPTURED = "captured"
+CAPTURED_DIR = Path(__file__).resolve().parent / CAPTURED
+
+# Wie in KVVApi; die Benchmarks laufen gegen einen lokalen Server
+DEPARTURE_URL = "https://projekte.kvv-efa.de/sl3-alone/XSLT_DM_REQUEST"
+STOPFINDER_URL = "https://www.kvv.de/tunnelEfaDirect.php"
+
+
+def _efa_datetime(dt: datetime) -> dict:
+    return {
+        "year": str(dt.year),
+        "month": str(dt.month),
+        "day": str(dt.day),
+        "weekday": str(dt.isoweekday() % 7 + 1),
+        "hour": str(dt.hour),
+        "minute": str(dt.minute),
+    }
+
+
+def _lines(count: int) -> list[dict]:
+    lines = []
+    for i in range(count):
+        number = f"S{i // 2 + 1}" if i < 16 else str(i)
+        lines.append(
+            {
+                "number": number,
+                "line_id": f"{22300 + i // 2}",
+                "dir": "H" if i % 2 == 0 else "R",
+                "destination": f"Ziel {i}",
+            }
+        )
+    return lines
+
+
+def departure_monitor(departures: int, line_count: int, seed: int = 1) -> dict:
+    """Antwort von XSLT_DM_REQUEST mit `departures` Einträgen."""
+    rng = random.Random(seed)
+    lines = _lines(line_count)
+
+    departure_list = []
+    for i in range(departures):
+        line = lines[rng.randrange(line_count)]
+        planned = START + timedelta(minutes=i // 3)
+        delay = rng.choice([0, 0, 0, 1, 2, 5])
+        departure_list.append(
+            {
+                "stopID": STATION_ID,
+                "x": "8.40226",
+                "y": "48.99369",
+                "mapName": "WGS84[dd.ddddd]",
+                "area": "1",
+                "platform": str(rng.randrange(1, 12)),
+                "platformName": f"Gleis {rng.randrange(1, 12)}",
+                "stopName": "Karlsruhe Hbf",
+                "nameWO": "Hbf",
+                "pointType": "Gleis",
+                "countdown": str(i // 3 + delay),
+                "realtime": "1",
+                "dateTime": _efa_datetime(planned),
+                "realDateTime": _efa_datetime(planned + timedelta(minutes=delay)),
+                "servingLine": {
+                    "key": str(rng.randrange(1000, 9999)),
+                    "code": "1",
+                    "number": line["number"],
+                    "symbol": line["number"],
+                    "motType": "1",
+                    "mtSubcode": "0",
+                    "realtime": "1",
+                    "direction": line["destination"],
+                    "directionFrom": "Karlsruhe Hbf",
+                    "name": "S-Bahn",
+                    "delay": str(delay),
+                    "liErgRiProj": {
+                        "line": line["line_id"],
+                        "project": "j25",
+                        "direction": line["dir"],
+                        "supplement": " ",
+                        "network": "kvv",
+                        "gid": f"kvv:{line['line_id']}:{line['dir']}:j25",
+                    },
+                    "destID": str(7000000 + rng.randrange(999)),
+                    "stateless": f"kvv:{line['line_id']}:E:{line['dir']}:j25",
+                },
+                "operator": {"code": "01", "name": "AVG", "publicCode": "1"},
+                "attrs": [
+                    {"name": "TripCode", "value": str(rng.randrange(100000))},
+                    {"name": "AVMSTripID", "value": str(rng.randrange(10**6))},
+                ],
+            }
+        )
+
+    return {
+        "parameters": [{"name": "serverID", "value": "EFA10_04"}],
+        "dm": {"input": {"input": STATION_ID}, "points": {"point": {}}},
+        "arr": {"input": {"input": ""}, "points": None},
+        "dateTime": {"deparr": "dep", "ttpFrom": "20241215", "ttpTo": "20251213"},
+        "dateRange": [_efa_datetime(START + timedelta(days=d)) for d in range(7)],
+        "servingLines": {
+            "lines": [
+                {
+                    "mode": {
+                        "name": "S-Bahn",
+                        "number": line["number"],
+                        "product": "S-Bahn",
+                        "destination": line["destination"],
+                        "diva": {
+                            "line": line["line_id"],
+                            "dir": line["dir"],
+                            "project": "j25",
+                            "network": "kvv",
+                        },
+                    },
+                    "index": f"{i}:0",
+                }
+                for i, line in enumerate(lines)
+            ]
+        },
+        "departureList": departure_list,
+    }
+
+
+def stop_finder(points: int, seed: int = 1) -> dict:
+    """Antwort von XSLT_STOPFINDER_REQUEST mit `points` Treffern."""
+    rng = random.Random(seed)
+    return {
+        "parameters": [{"name": "serverID", "value": "EFA10_04"}],
+        "stopFinder": {
+            "input": {"input": "Karlsruhe"},
+            "points": [
+                {
+                    "usage": "sf",
+                    "type": "any",
+                    "name": f"Karlsruhe, Haltestelle {i}",
+                    "stateless": str(7000000 + i),
+                    "anyType": "stop" if i % 4 else "street",
+                    "sort": "2",
+                    "quality": str(rng.randrange(100, 1000)),
+                    "best": "0",
+                    "object": f"Haltestelle {i}",
+                    "ref": {
+                        "id": str(7000000 + i),
+                        "gid": f"de:08212:{i}",
+                        "omc": "8212000",
+                        "placeID": "5",
+                        "place": "Karlsruhe",
+                        "coords": "8.40000,49.00000",
+                    },
+                }
+                for i in range(points)
+            ],
+        },
+    }
+
+
+def allowed_lines(line_count: int, selected: int = 1) -> list[dict]:
+    """Linienfilter wie in entry.data["serving_lines"]."""
+    return [
+        {"line": l["number"], "line_id": l["line_id"], "dir": l["dir"]}
+        for l in _lines(line_count)[:selected]
+    ]
+
+
+def _captured() -> dict[str, bytes] | None:
+    """Aufgezeichnete Antworten, None solange nicht beide vorliegen."""
+    files = {name: CAPTURED_DIR / f"{name}.json" for name in ("dm", "stopfinder")}
+    if not all(path.exists() for path in files.values()):
+        return None
+    return {name: path.read_bytes() for name, path in files.items()}
+
+
+def scenarios() -> list[str]:
+    """Namen aller Szenarien, mit captured nur wenn aufgezeichnet."""
+    names = list(SCENARIOS)
+    if _captured() is not None:
+        names.append(CAPTURED)
+    return names
+
+
+def scenario_setup(name: str) -> tuple[int, list[dict]]:
+    """Abfahrtslimit und Linienfilter (eine Linie) eines Szenarios."""
+    if name != CAPTURED:
+        deps, line_count, _ = SCENARIOS[name]
+        return deps, allowed_lines(line_count)
+    dm = json.loads(_captured()["dm"])
+    lines = (dm.get("servingLines") or {}).get("lines") or []
+    return len(dm.get("departureList") or []), [
+        {
+            "line": line["mode"]["number"],
+            "line_id": line["mode"]["diva"]["line"],
+            "dir": line["mode"]["diva"]["dir"],
+        }
+        for line in lines[:1]
+    ]
+
+
+def payloads() -> dict[str, dict[str, bytes]]:
+    """Alle Szenarien als fertige JSON-Bytes."""
+    result = {
+        name: {
+            "dm": json.dumps(departure_monitor(deps, lines)).encode(),
+            "stopfinder": json.dumps(stop_finder(points)).encode(),
+        }
+        for name, (deps, lines, points) in SCENARIOS.items()
+    }
+    captured = _captured()
+    if captured is not None:
+        result[CAPTURED] = captured
+    return result
+
+
+async def capture(station_id: str, name: str, limit: int) -> None:
+    """Zeichnet je eine echte DM- und Stopfinder-Antwort der EFA auf."""
+    from aiohttp import ClientSession
+
+    requests = {
+        "dm": (
+            DEPARTURE_URL,
+            {
+                "outputFormat": "JSON",
+                "coordOutputFormat": "WGS84[dd.ddddd]",
+                "depType": "stopEvents",
+                "locationServerActive": "1",
+                "mode": "direct",
+                "name_dm": station_id,
+                "type_dm": "stop",
+                "useOnlyStops": "1",
+                "useRealtime": "1",
+                "limit": limit,
+            },
+        ),
+        "stopfinder": (
+            STOPFINDER_URL,
+            {
+                "action": "XSLT_STOPFINDER_REQUEST",
+                "coordOutputFormat": "WGS84[dd.ddddd]",
+                "name_sf": name,
+                "outputFormat": "JSON",
+                "type_sf": "any",
+            },
+        ),
+    }
+    CAPTURED_DIR.mkdir(exist_ok=True)
+    async with ClientSession() as session:
+        for file, (url, params) in requests.items():
+            async with session.get(url, params=params) as response:
+                response.raise_for_status()
+                body = await response.read()
+            json.loads(body)  # Nur gültige Antworten speichern
+            path = CAPTURED_DIR / f"{file}.json"
+            path.write_bytes(body)
+            print(f"{path}: {len(body)} Bytes")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Echte EFA-Antworten aufzeichnen")
+    parser.add_argument("--capture", metavar="STATION_ID", required=True)
+    parser.add_argument("name", nargs="?", default="Karlsruhe")
+    parser.add_argument("--limit", type=int, default=40)
+    args = parser.parse_args()
+    asyncio.run(capture(args.capture, args.name, args.limit))
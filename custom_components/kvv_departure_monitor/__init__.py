@@ -1,57 +1,209 @@
 import logging
-from homeassistant.config_entries import ConfigEntry
+from homeassistant.config_entries import ConfigEntry, ConfigEntryState
 from homeassistant.core import HomeAssistant
-from homeassistant.exceptions import ConfigEntryNotReady
 from homeassistant.const import Platform
-from .api import KVVApi
-from .sensor import KVVDataCoordinator
-from .const import DOMAIN, DEFAULT_UPDATE_INTERVAL
+from homeassistant.exceptions import ConfigEntryNotReady
+import homeassistant.helpers.config_validation as cv
+from .api import get_api
+from .scheduler import get_scheduler
+from .metrics import get_metrics
+from .snapshots import async_get_snapshots
+from .timetable import async_get_timetable
+from .delays import async_get_delay_stats
+from .services import async_setup_services
+from .coordinator import KVVDataCoordinator, entry_serving_lines
+from .const import DOMAIN
 
 _LOGGER = logging.getLogger(__name__)
 PLATFORMS: list[str] = [Platform.SENSOR]
+CONFIG_SCHEMA = cv.config_entry_only_config_schema(DOMAIN)
+
+
+async def async_setup(hass: HomeAssistant, config: dict):
+    """Registriert die Dienste, unabhängig von einzelnen Entries."""
+    async_setup_services(hass)
+    return True
 
 
 async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry):
-    """Setzt die KVV-Integration auf, wenn der Benutzer sie über den Config Flow einrichtet."""
+    """Setzt die KVV-Integration auf, wenn der Benutzer sie über den Config Flow einrichtet.
+
+    Das Setup wartet nicht auf die KVV-API: die Sensoren starten mit den
+    zuletzt gespeicherten Abfahrten, der erste Abruf läuft im Hintergrund.
+    """
     _LOGGER.debug("Starte Setup für KVV-Integration: %s", entry.data)
 
     hass.data.setdefault(DOMAIN, {})
+    if entry.data.get("journey"):
+        return await _async_setup_journey(hass, entry)
 
-    # API erstellen
-    api = KVVApi(hass)
+    # API wird von allen Entries gemeinsam genutzt
+    api = get_api(hass)
     station_id = entry.data.get("station_id")
 
-    # Testabfrage der API
-    try:
-        if station_id:
-            test_departures = await api.get_departures_by_station_id(
-                station_id, limit=1
-            )
+    # Vorher laden: zwischen Nachsehen und Eintragen des Coordinators darf
+    # kein await liegen, sonst legen parallel startende Entries je einen an
+    snapshots = await async_get_snapshots(hass)
+    timetable = await async_get_timetable(hass)
+    delays = await async_get_delay_stats(hass)
 
-    except Exception as e:
-        _LOGGER.error("KVV API nicht erreichbar: %s", e)
-        raise ConfigEntryNotReady from e
-
-    # Coordinator anlegen
-    coordinator = KVVDataCoordinator(hass, api, station_id, entry)
-    await coordinator.async_config_entry_first_refresh()
+    # Ein Coordinator pro Haltestelle, gemeinsam für alle Entries
+    stations = hass.data[DOMAIN].setdefault("stations", {})
+    coordinator = stations.get(station_id)
+    if coordinator is None:
+        coordinator = stations[station_id] = KVVDataCoordinator(
+            hass,
+            api,
+            get_scheduler(hass),
+            get_metrics(hass),
+            station_id,
+            snapshots,
+            timetable,
+            delays,
+        )
+        coordinator.add_subscriber(entry)
+        # Sonst plant der erste Listener den Abruf nach dem Restintervall
+        if coordinator.restore_snapshot():
+            _async_refresh_in_background(hass, coordinator)
+    elif coordinator.add_subscriber(entry):
+        # Vorhandene Daten decken Limit/Linien des neuen Entries nicht ab
+        _async_refresh_in_background(hass, coordinator)
 
     # API + Coordinator gemeinsam in hass.data speichern
-    hass.data[DOMAIN][entry.entry_id] = {"api": api, "coordinator": coordinator}
+    hass.data[DOMAIN][entry.entry_id] = {
+        "api": api,
+        "coordinator": coordinator,
+        "entity_options": _entity_options(entry),
+    }
+    entry.async_on_unload(entry.add_update_listener(_async_update_listener))
 
     # Sensor-Plattform laden
     await hass.config_entries.async_forward_entry_setups(entry, PLATFORMS)
     return True
 
 
+async def _async_setup_journey(hass: HomeAssistant, entry: ConfigEntry):
+    """Setzt eine Verbindung über mehrere Haltestellen-Entries auf.
+
+    Eigene Abrufe gibt es nicht; der Sensor liest die Coordinators der
+    Haltestellen. Gewartet wird nur auf Haltestellen, die gerade noch
+    eingerichtet werden; deaktivierte oder fehlgeschlagene werden
+    ausgelassen und vom Sensor übernommen, sobald sie geladen sind.
+    """
+    missing = []
+    for member in entry.data.get("members", []):
+        member_entry = hass.config_entries.async_get_entry(member["entry_id"])
+        if member_entry is None or member["entry_id"] in hass.data[DOMAIN]:
+            continue
+        if member_entry.state is ConfigEntryState.SETUP_IN_PROGRESS or (
+            member_entry.state is ConfigEntryState.NOT_LOADED
+            and member_entry.disabled_by is None
+        ):
+            missing.append(member["entry_id"])
+    if missing:
+        raise ConfigEntryNotReady(f"Haltestellen noch nicht geladen: {missing}")
+
+    hass.data[DOMAIN][entry.entry_id] = {"journey": True}
+    entry.async_on_unload(entry.add_update_listener(_async_reload_journey))
+    await hass.config_entries.async_forward_entry_setups(entry, PLATFORMS)
+    return True
+
+
+async def _async_reload_journey(hass: HomeAssistant, entry: ConfigEntry):
+    """Verbindungen haben keine eigenen Abrufe, ein Reload kostet nichts."""
+    hass.config_entries.async_schedule_reload(entry.entry_id)
+
+
+def _async_refresh_in_background(
+    hass: HomeAssistant, coordinator: KVVDataCoordinator
+) -> None:
+    """Startet einen Abruf, ohne das Setup darauf warten zu lassen.
+
+    Geht über den Debouncer des Coordinators: melden sich mehrere Entries
+    während des ersten Abrufs an, folgt höchstens ein weiterer.
+    """
+    hass.async_create_background_task(
+        coordinator.async_request_background_refresh(),
+        name=f"{DOMAIN} first refresh {coordinator.station_id}",
+    )
+
+
+def _entity_options(entry: ConfigEntry) -> tuple:
+    """Optionen, die bestimmen, welche Entities angelegt werden."""
+    per_line_sensors = entry.options.get("per_line_sensors", False)
+    delay_sensors = entry.options.get("delay_sensors", False)
+    lines = None
+    if per_line_sensors or delay_sensors:
+        lines = [(l["line_id"], l["dir"]) for l in entry_serving_lines(entry)]
+    return (
+        entry.options.get("timestamp_state", False),
+        per_line_sensors,
+        delay_sensors,
+        lines,
+    )
+
+
+async def _async_update_listener(hass: HomeAssistant, entry: ConfigEntry):
+    """Wendet geänderte Optionen an, ohne den Entry neu zu laden.
+
+    Intervall, Limit und Linienfilter übernimmt der laufende Coordinator.
+    Nur wenn sich die Menge der Entities ändert, wird neu geladen.
+    """
+    stored_data = hass.data[DOMAIN][entry.entry_id]
+    if _entity_options(entry) != stored_data["entity_options"]:
+        hass.config_entries.async_schedule_reload(entry.entry_id)
+        return
+
+    coordinator = stored_data["coordinator"]
+    if coordinator.update_subscriber(entry):
+        await coordinator.async_request_refresh()
+    else:
+        # Vorhandene Daten reichen, die Sensoren filtern nur neu
+        coordinator.async_update_listeners()
+
+
 async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry):
     """Wird aufgerufen, wenn der Benutzer die Integration entfernt."""
     unload_ok = await hass.config_entries.async_unload_platforms(entry, PLATFORMS)
     if unload_ok:
-        hass.data[DOMAIN].pop(entry.entry_id, None)
+        stored_data = hass.data[DOMAIN].pop(entry.entry_id, None)
+        if stored_data and "coordinator" in stored_data:
+            await _async_release_coordinator(hass, entry, stored_data["coordinator"])
     return unload_ok
 
 
+async def _async_release_coordinator(
+    hass: HomeAssistant, entry: ConfigEntry, coordinator: KVVDataCoordinator
+):
+    """Meldet den Entry vom Coordinator ab und beendet ihn, wenn ihn niemand mehr nutzt."""
+    if coordinator.remove_subscriber(entry.entry_id):
+        stations = hass.data[DOMAIN]["stations"]
+        # Nur den eigenen Coordinator austragen, nicht einen neueren
+        if stations.get(coordinator.station_id) is coordinator:
+            del stations[coordinator.station_id]
+        coordinator.scheduler.release_phase(coordinator.station_id)
+        await coordinator.async_shutdown()
+
+
+async def async_remove_entry(hass: HomeAssistant, entry: ConfigEntry):
+    """Vergisst Abfahrten, Fahrplan und Statistik, wenn kein Entry die Haltestelle mehr nutzt."""
+    station_id = entry.data.get("station_id")
+    if station_id is None:
+        return
+    if any(
+        other.data.get("station_id") == station_id
+        for other in hass.config_entries.async_entries(DOMAIN)
+        if other.entry_id != entry.entry_id
+    ):
+        return
+    snapshots = await async_get_snapshots(hass)
+    snapshots.remove(station_id)
+    timetable = await async_get_timetable(hass)
+    timetable.remove(station_id)
+    delays = await async_get_delay_stats(hass)
+    delays.remove(station_id)
+
+
 async def async_reload_entry(hass: HomeAssistant, entry: ConfigEntry):
     """Wird bei Optionsänderung aufgerufen."""
     await async_unload_entry(hass, entry)
@@ -1,55 +1,263 @@
 import logging
 import asyncio
-from aiohttp import ClientError
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+from urllib.parse import urlsplit
+from aiohttp import ClientError, ClientTimeout
 from homeassistant.helpers.aiohttp_client import async_get_clientsession
+from homeassistant.util.json import json_loads
+from .const import (
+    DOMAIN,
+    STOPFINDER_CACHE_TTL,
+    SERVING_LINES_CACHE_TTL,
+    DEPARTURES_CACHE_TTL,
+    API_CACHE_SIZE,
+    CONNECT_TIMEOUT,
+    READ_TIMEOUT,
+    MAX_RETRIES,
+    RETRY_BASE_DELAY,
+    BREAKER_FAILURE_THRESHOLD,
+    BREAKER_RESET_TIMEOUT,
+)
+from datetime import datetime
+from .models import Departure, DeparturePage, EFA_TIMEZONE, parse_efa_datetime
+from .resilience import CircuitBreaker, backoff_delay
+from .scheduler import KVVRequestScheduler, get_scheduler
+from .metrics import KVVMetrics, get_metrics
 
 _LOGGER = logging.getLogger(__name__)
 
 
+def get_api(hass) -> "KVVApi":
+    """Liefert die gemeinsame API-Instanz, damit sich alle Aufrufer den Cache teilen."""
+    domain_data = hass.data.setdefault(DOMAIN, {})
+    api = domain_data.get("api")
+    if api is None:
+        api = domain_data["api"] = KVVApi(
+            hass, scheduler=get_scheduler(hass), metrics=get_metrics(hass)
+        )
+    return api
+
+
+class _CacheEntry(NamedTuple):
+    """Gecachte Antwort samt Validatoren für bedingte Anfragen."""
+
+    fetched: float
+    data: dict
+    etag: str | None = None
+    last_modified: str | None = None
+
+
 class KVVApi:
     # Stopfinder-URL (Stationssuche)
     BASE_URL = "https://www.kvv.de/tunnelEfaDirect.php"
     # Abfahrtsmonitor-URL
     DEPARTURE_URL = "https://projekte.kvv-efa.de/sl3-alone/XSLT_DM_REQUEST"
 
-    def __init__(self, hass):
+    def __init__(
+        self,
+        hass,
+        connect_timeout: float = CONNECT_TIMEOUT,
+        read_timeout: float = READ_TIMEOUT,
+        scheduler: KVVRequestScheduler | None = None,
+        metrics: KVVMetrics | None = None,
+        session=None,
+    ):
         """Initialisiert die API und nutzt die Home Assistant HTTP-Session."""
         self._hass = hass
-        self._session = async_get_clientsession(hass)
+        # Eigene Session nur für Benchmarks außerhalb von Home Assistant
+        self._session = session or async_get_clientsession(hass)
+        # Ratenbegrenzung; ohne Scheduler wird nicht gedrosselt
+        self._scheduler = scheduler
+        self.metrics = metrics or KVVMetrics()
+        self._timeout = ClientTimeout(
+            total=connect_timeout + read_timeout,
+            sock_connect=connect_timeout,
+            sock_read=read_timeout,
+        )
+        # Ein Circuit Breaker pro Host (Stopfinder / Abfahrtsmonitor)
+        self._breakers: dict[str, CircuitBreaker] = {}
+        # Antwort-Cache (LRU) und laufende Anfragen, jeweils nach URL + Parametern
+        self._cache: OrderedDict[tuple, _CacheEntry] = OrderedDict()
+        self._inflight: dict[tuple, asyncio.Future] = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.not_modified = 0
 
-    async def _get(self, url, params):
-        """Generische GET-Anfrage mit Fehlerbehandlung."""
-        try:
-            async with self._session.get(url, params=params, timeout=15) as response:
-                if response.status != 200:
-                    raise Exception(f"HTTP {response.status} bei Anfrage an {url}")
-                content_type = response.headers.get("Content-Type", "")
-                if (
-                    "application/json" not in content_type
-                    and "text/json" not in content_type
-                ):
-                    text_preview = await response.text()
-                    raise Exception(
-                        f"Unerwarteter Content-Type ({content_type}). "
-                        f"URL: {response.url} - Antwort: {text_preview[:150]}"
-                    )
-                return await response.json()
-        except asyncio.TimeoutError:
-            raise Exception("Timeout bei der API-Anfrage")
-        except ClientError as e:
-            raise Exception(f"Fehler bei der API-Anfrage: {e}")
+    @staticmethod
+    def _cache_key(url, params) -> tuple:
+        """Normalisiert URL und Parameter zu einem Cache-Schlüssel."""
+        return (url, tuple(sorted((k, str(v).strip()) for k, v in params.items())))
+
+    def cache_info(self) -> dict:
+        """Trefferstatistik des Antwort-Caches."""
+        return {
+            "hits": self.cache_hits,
+            "misses": self.cache_misses,
+            "size": len(self._cache),
+            "inflight": len(self._inflight),
+            "not_modified": self.not_modified,
+        }
+
+    def breaker_info(self) -> dict:
+        """Zustand der Circuit Breaker je Host."""
+        return {
+            host: {"state": breaker.state, "failures": breaker.failures}
+            for host, breaker in self._breakers.items()
+        }
+
+    def _endpoint(self, url) -> str:
+        """Name des Endpunkts für die Laufzeitmessung."""
+        return "stopfinder" if url == self.BASE_URL else "departure_monitor"
+
+    def _breaker_for(self, url) -> CircuitBreaker:
+        host = urlsplit(url).netloc
+        breaker = self._breakers.get(host)
+        if breaker is None:
+            breaker = self._breakers[host] = CircuitBreaker(
+                host, BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT
+            )
+        return breaker
+
+    async def _request(self, url, send):
+        """Führt `send` mit Circuit Breaker und Wiederholungen aus.
+
+        Netzwerkfehler und Timeouts werden mit exponentiellem Backoff
+        wiederholt; jeder Fehler zählt für den Breaker des Hosts.
+        """
+        breaker = self._breaker_for(url)
+        if not breaker.allow_request():
+            raise Exception(
+                f"Anfragen an {breaker.name} nach wiederholten Fehlern "
+                "vorübergehend ausgesetzt"
+            )
+
+        attempt = 0
+        while True:
+            if self._scheduler is not None:
+                await self._scheduler.acquire()
+            try:
+                result = await send()
+            except (asyncio.TimeoutError, ClientError) as e:
+                breaker.record_failure()
+                if attempt >= MAX_RETRIES or not breaker.allow_request():
+                    if isinstance(e, asyncio.TimeoutError):
+                        raise Exception("Timeout bei der API-Anfrage")
+                    raise Exception(f"Fehler bei der API-Anfrage: {e}")
+                await asyncio.sleep(backoff_delay(attempt, RETRY_BASE_DELAY))
+                attempt += 1
+            except Exception:
+                breaker.record_failure()
+                raise
+            else:
+                breaker.record_success()
+                return result
+
+    async def _get(self, url, params, max_age: float = 0):
+        """GET-Anfrage mit Antwort-Cache.
+
+        Antworten, die jünger als ``max_age`` Sekunden sind, kommen aus dem
+        Cache. Gleichzeitige identische Anfragen teilen sich einen Request.
+        """
+        key = self._cache_key(url, params)
+
+        cached = self._cache.get(key)
+        if cached is not None and time.monotonic() - cached.fetched < max_age:
+            self._cache.move_to_end(key)
+            self.cache_hits += 1
+            return cached.data
+
+        request = self._inflight.get(key)
+        if request is not None:
+            self.cache_hits += 1
+        else:
+            self.cache_misses += 1
+            # Abgelaufene Einträge liefern noch ETag/Last-Modified
+            request = asyncio.ensure_future(self._fetch(url, params, cached))
+            self._inflight[key] = request
+            request.add_done_callback(lambda done: self._finish_request(key, done))
+
+        # shield: bricht ein Aufrufer ab, läuft die Anfrage für die anderen weiter
+        return (await asyncio.shield(request)).data
+
+    def _finish_request(self, key: tuple, request: asyncio.Future) -> None:
+        """Übernimmt das Ergebnis einer abgeschlossenen Anfrage in den Cache."""
+        self._inflight.pop(key, None)
+        if request.cancelled() or request.exception() is not None:
+            return
+        self._cache[key] = request.result()
+        self._cache.move_to_end(key)
+        while len(self._cache) > API_CACHE_SIZE:
+            self._cache.popitem(last=False)
+
+    async def _fetch(self, url, params, cached: _CacheEntry | None = None):
+        """Generische GET-Anfrage mit Fehlerbehandlung.
+
+        Liegt eine frühere Antwort vor, wird bedingt angefragt; bei 304 wird
+        deren Inhalt mit neuem Zeitstempel weiterverwendet.
+        """
+        headers = {}
+        if cached is not None:
+            if cached.etag:
+                headers["If-None-Match"] = cached.etag
+            if cached.last_modified:
+                headers["If-Modified-Since"] = cached.last_modified
+
+        endpoint = self._endpoint(url)
+
+        async def _send():
+            start = time.perf_counter()
+            async with self._session.get(
+                url, params=params, headers=headers, timeout=self._timeout
+            ) as response:
+                # Zeit bis zu den Headern, inkl. DNS und Verbindungsaufbau
+                self.metrics.record(
+                    endpoint, "ttfb_ms", (time.perf_counter() - start) * 1000
+                )
+                if response.status == 304 and cached is not None:
+                    self.not_modified += 1
+                    return cached._replace(fetched=time.monotonic())
+                await self._check_response(response, url)
+
+                with self.metrics.timer(endpoint, "body_ms"):
+                    body = await response.read()
+                self.metrics.record(endpoint, "body_bytes", len(body))
+                with self.metrics.timer(endpoint, "decode_ms"):
+                    data = json_loads(body)
+                return _CacheEntry(
+                    time.monotonic(),
+                    data,
+                    response.headers.get("ETag"),
+                    response.headers.get("Last-Modified"),
+                )
+
+        return await self._request(url, _send)
+
+    @staticmethod
+    async def _check_response(response, url):
+        """Prüft Statuscode und Content-Type einer Antwort."""
+        if response.status != 200:
+            raise Exception(f"HTTP {response.status} bei Anfrage an {url}")
+        content_type = response.headers.get("Content-Type", "")
+        if "application/json" not in content_type and "text/json" not in content_type:
+            text_preview = await response.text()
+            raise Exception(
+                f"Unerwarteter Content-Type ({content_type}). "
+                f"URL: {response.url} - Antwort: {text_preview[:150]}"
+            )
 
     async def get_points_by_name(self, name: str):
         """Sucht Haltestellen anhand eines Namens."""
         params = {
             "action": "XSLT_STOPFINDER_REQUEST",
             "coordOutputFormat": "WGS84[dd.ddddd]",
-            "name_sf": name,
+            "name_sf": name.strip(),
             "outputFormat": "JSON",
             "type_sf": "any",
         }
 
-        data = await self._get(self.BASE_URL, params)
+        data = await self._get(self.BASE_URL, params, STOPFINDER_CACHE_TTL)
         if not data:
             return []
 
@@ -108,6 +316,21 @@ class KVVApi:
         Holt die nächsten Abfahrten an einer bestimmten Haltestelle.
         WICHTIG: Nutzt ausschließlich DEPARTURE_URL.
         """
+        page = await self.get_departure_page(station_id, limit, allowed_lines)
+        return page.departures
+
+    async def get_departure_page(
+        self,
+        station_id: str,
+        limit: int = 10,
+        allowed_lines: list[dict] | None = None,
+        start: float | None = None,
+        max_matches: int | None = None,
+    ) -> DeparturePage:
+        """
+        Fragt `limit` Abfahrten ab `start` (Unix-Zeit, sonst jetzt) ab und
+        filtert sie. Mit `max_matches` höchstens so viele Treffer.
+        """
         params = {
             "outputFormat": "JSON",
             "coordOutputFormat": "WGS84[dd.ddddd]",
@@ -120,50 +343,46 @@ class KVVApi:
             "useRealtime": "1",
             "limit": limit,
         }
+        if start is not None:
+            start_dt = datetime.fromtimestamp(start, EFA_TIMEZONE)
+            params["itdDate"] = start_dt.strftime("%Y%m%d")
+            params["itdTime"] = start_dt.strftime("%H%M")
 
-        departures: list[dict] = []  # ✅ IMMER initialisieren
+        page = DeparturePage([])  # ✅ IMMER initialisieren
 
-        data = await self._get(self.DEPARTURE_URL, params)
-        if not data:
-            _LOGGER.warning("Keine Daten von der KVV-Abfahrts-API erhalten")
-            return departures
+        # 🔑 Filter-Set vorbereiten
+        allowed = None
+        if allowed_lines:
+            allowed = {(l["line_id"], l["dir"]) for l in allowed_lines}
+
+        data = await self._get(self.DEPARTURE_URL, params, DEPARTURES_CACHE_TTL)
+        if not isinstance(data, dict):
+            # Fehler statt leerer Seite, damit die letzten Daten stehen bleiben
+            raise Exception("Keine gültigen Daten von der KVV-Abfahrts-API erhalten")
 
         try:
-            departure_list = data.get("departureList", [])
+            # Ohne Abfahrten (z.B. nachts) fehlt die Liste oder ist null
+            departure_list = data.get("departureList") or []
             if not isinstance(departure_list, list):
-                return departures
-
-            # 🔑 Filter-Set vorbereiten
-            allowed = None
-            if allowed_lines:
-                allowed = {(l["line_id"], l["dir"]) for l in allowed_lines}
-
-            for dep in departure_list:
-                serving = dep.get("servingLine", {})
-                proj = serving.get("liErgRiProj", {})
-                # mode = dep.get("mode", {})
-
-                line_id = proj.get("line")
-                dir_code = proj.get("direction")
+                raise TypeError(f"departureList ist {type(departure_list).__name__}")
 
-                if allowed and (line_id, dir_code) not in allowed:
-                    continue
-
-                departures.append(
-                    {
-                        "line": serving.get("number", "?"),
-                        "direction": serving.get("direction", "Unbekannt"),
-                        "countdown": dep.get("countdown", "?"),
-                        "realtime": bool(dep.get("realtime", False)),
-                        "dateTime": dep.get("dateTime"),
-                        "realDateTime": dep.get("realDateTime"),
-                    }
+            page.scanned = len(departure_list)
+            if departure_list:
+                page.last_planned = parse_efa_datetime(
+                    departure_list[-1].get("dateTime")
                 )
-            return departures
+            with self.metrics.timer("departure_monitor", "filter_ms"):
+                for dep in departure_list:
+                    departure = _parse_departure(dep, allowed)
+                    if departure is not None:
+                        page.departures.append(departure)
+                if max_matches is not None:
+                    del page.departures[max_matches:]
+            self.metrics.record("departure_monitor", "results", len(page.departures))
+            return page
 
         except Exception as e:
-            _LOGGER.error("Fehler beim Verarbeiten der Abfahrtsdaten: %s", e)
-            return departures
+            raise Exception(f"Fehler beim Verarbeiten der Abfahrtsdaten: {e}") from e
 
     async def get_serving_lines(self, station_id: str):
         """
@@ -183,7 +402,7 @@ class KVVApi:
             "limit": 1,  # reicht – servingLines ist unabhängig von limit
         }
 
-        data = await self._get(self.DEPARTURE_URL, params)
+        data = await self._get(self.DEPARTURE_URL, params, SERVING_LINES_CACHE_TTL)
         if not data:
             return []
 
@@ -194,3 +413,11 @@ class KVVApi:
             return []
 
         return lines
+
+
+def _parse_departure(dep: dict, allowed: set | None) -> Departure | None:
+    """Wandelt einen departureList-Eintrag um, None wenn ihn der Filter verwirft."""
+    proj = dep.get("servingLine", {}).get("liErgRiProj", {})
+    if allowed and (proj.get("line"), proj.get("direction")) not in allowed:
+        return None
+    return Departure.from_efa(dep)
@@ -0,0 +1,209 @@
+"""Lokaler, persistenter Katalog für Haltestellen und Linien.
+
+Stationssuchen (Name → Haltestellen) und Linien einer Haltestelle ändern sich
+kaum. Der Katalog beantwortet sie sofort aus dem Speicher und fragt die
+KVV-API nur bei einem Fehltreffer; veraltete Einträge werden im Hintergrund
+aktualisiert.
+"""
+
+import asyncio
+import logging
+import time
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.storage import Store
+from .api import get_api
+from .search import StationIndex
+from .const import (
+    DOMAIN,
+    CATALOG_STORAGE_VERSION,
+    CATALOG_MAX_AGE,
+    CATALOG_MAX_SEARCHES,
+    CATALOG_SAVE_DELAY,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+STORAGE_KEY = f"{DOMAIN}.catalog"
+
+
+def compact_serving_lines(raw: list[dict]) -> list[dict]:
+    """Reduziert servingLines.lines auf Linie, Linien-ID, Richtung und Ziel."""
+    lines = []
+    for entry in raw:
+        mode = entry.get("mode", {})
+        diva = mode.get("diva", {})
+
+        line_id = diva.get("line")  # z.B. "22305"
+        dir_code = diva.get("dir")  # "H" / "R"
+        number = mode.get("number")  # "S5"
+        destination = mode.get("destination")  # "Wörth (Rhein)"
+
+        if not all([line_id, dir_code, number, destination]):
+            continue
+
+        lines.append(
+            {
+                "line": number,
+                "line_id": line_id,
+                "dir": dir_code,
+                "destination": destination,
+            }
+        )
+    return lines
+
+
+async def async_get_catalog(hass: HomeAssistant) -> "KVVCatalog":
+    """Liefert den gemeinsamen, geladenen Katalog."""
+    domain_data = hass.data.setdefault(DOMAIN, {})
+    catalog = domain_data.get("catalog")
+    if catalog is None:
+        catalog = domain_data["catalog"] = KVVCatalog(hass)
+    await catalog.async_load()
+    return catalog
+
+
+class KVVCatalog:
+    """Name → Haltestellen und Haltestelle → Linien, versioniert gespeichert."""
+
+    def __init__(self, hass: HomeAssistant):
+        self._hass = hass
+        self._store = Store(hass, CATALOG_STORAGE_VERSION, STORAGE_KEY)
+        self._load_task: asyncio.Future | None = None
+        # Suchbegriff (normalisiert) → {"updated": ts, "points": [{name, id}]}
+        self._stops: dict[str, dict] = {}
+        # station_id → {"updated": ts, "lines": [{line, line_id, dir, destination}]}
+        self._lines: dict[str, dict] = {}
+        self._refreshing: set[tuple] = set()
+        # Suchindex über alle bisher gefundenen Haltestellen
+        self.index = StationIndex()
+
+    async def async_load(self) -> None:
+        """Lädt den Katalog einmalig aus dem Speicher."""
+        if self._load_task is None:
+            self._load_task = asyncio.ensure_future(self._async_load())
+        await self._load_task
+
+    async def _async_load(self) -> None:
+        data = await self._store.async_load()
+        if not data:
+            return
+
+        # Auf der Platte als Listen gespeichert, um Platz zu sparen
+        for key, item in data.get("stops", {}).items():
+            self._stops[key] = {
+                "updated": item["updated"],
+                "points": [{"name": n, "id": i} for n, i in item["points"]],
+            }
+            self.index.add(self._stops[key]["points"])
+        for station_id, item in data.get("lines", {}).items():
+            self._lines[station_id] = {
+                "updated": item["updated"],
+                "lines": [
+                    {"line": l, "line_id": i, "dir": d, "destination": dest}
+                    for l, i, d, dest in item["lines"]
+                ],
+            }
+
+    def _data_to_save(self) -> dict:
+        return {
+            "stops": {
+                key: {
+                    "updated": item["updated"],
+                    "points": [[p["name"], p["id"]] for p in item["points"]],
+                }
+                for key, item in self._stops.items()
+            },
+            "lines": {
+                station_id: {
+                    "updated": item["updated"],
+                    "lines": [
+                        [l["line"], l["line_id"], l["dir"], l["destination"]]
+                        for l in item["lines"]
+                    ],
+                }
+                for station_id, item in self._lines.items()
+            },
+        }
+
+    def _schedule_save(self) -> None:
+        self._store.async_delay_save(self._data_to_save, CATALOG_SAVE_DELAY)
+
+    @staticmethod
+    def _search_key(name: str) -> str:
+        return " ".join(name.split()).casefold()
+
+    def _is_stale(self, item: dict) -> bool:
+        return time.time() - item["updated"] > CATALOG_MAX_AGE
+
+    def _refresh_in_background(self, key: tuple, target) -> None:
+        """Aktualisiert einen veralteten Eintrag, ohne den Aufrufer warten zu lassen."""
+        if key in self._refreshing:
+            return
+        self._refreshing.add(key)
+
+        async def _refresh():
+            try:
+                await target()
+            except Exception as e:
+                _LOGGER.debug("Katalog-Aktualisierung %s fehlgeschlagen: %s", key, e)
+            finally:
+                self._refreshing.discard(key)
+
+        self._hass.async_create_background_task(
+            _refresh(), name=f"{DOMAIN} catalog refresh {key}"
+        )
+
+    def search(self, name: str) -> list[dict]:
+        """Sucht offline im lokalen Index (Präfix, sonst unscharf).
+
+        Der Index kennt nur Haltestellen früherer Suchen; er ersetzt den
+        Stopfinder nicht, sondern liefert Vorschläge bzw. den Rückfall ohne Netz.
+        """
+        return self.index.search(name)
+
+    async def async_get_points(self, name: str) -> list[dict]:
+        """Haltestellen zu einem Suchbegriff, bevorzugt aus dem Katalog."""
+        key = self._search_key(name)
+        item = self._stops.get(key)
+        if item is None:
+            return await self._async_fetch_points(name)
+
+        if self._is_stale(item):
+            self._refresh_in_background(
+                ("stops", key), lambda: self._async_fetch_points(name)
+            )
+        return item["points"]
+
+    async def _async_fetch_points(self, name: str) -> list[dict]:
+        points = await get_api(self._hass).get_points_by_name(name)
+        # Leere Treffer nicht merken, die Suche soll es erneut versuchen dürfen
+        if points:
+            key = self._search_key(name)
+            self._stops.pop(key, None)
+            self._stops[key] = {"updated": time.time(), "points": points}
+            self.index.add(points)
+            while len(self._stops) > CATALOG_MAX_SEARCHES:
+                self._stops.pop(next(iter(self._stops)))
+            self._schedule_save()
+        return points
+
+    async def async_get_serving_lines(self, station_id: str) -> list[dict]:
+        """Linien einer Haltestelle, bevorzugt aus dem Katalog."""
+        item = self._lines.get(station_id)
+        if item is None:
+            return await self._async_fetch_serving_lines(station_id)
+
+        if self._is_stale(item):
+            self._refresh_in_background(
+                ("lines", station_id),
+                lambda: self._async_fetch_serving_lines(station_id),
+            )
+        return item["lines"]
+
+    async def _async_fetch_serving_lines(self, station_id: str) -> list[dict]:
+        raw = await get_api(self._hass).get_serving_lines(station_id)
+        lines = compact_serving_lines(raw)
+        if lines:
+            self._lines[station_id] = {"updated": time.time(), "lines": lines}
+            self._schedule_save()
+        return lines
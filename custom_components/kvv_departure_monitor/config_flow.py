@@ -10,11 +10,21 @@ from homeassistant import config_entries
 
 from homeassistant.core import HomeAssistant, callback
 from homeassistant.exceptions import HomeAssistantError
-from .api import KVVApi
-from .const import DOMAIN, DEFAULT_UPDATE_INTERVAL, DEFAULT_ITEM_LIMIT
+from .catalog import async_get_catalog
+from .coordinator import entry_serving_lines
+from .const import (
+    DOMAIN,
+    DEFAULT_UPDATE_INTERVAL,
+    DEFAULT_ITEM_LIMIT,
+    DEFAULT_QUIET_HOURS_START,
+    DEFAULT_QUIET_HOURS_END,
+)
 
 _LOGGER = logging.getLogger(__name__)
 
+# Gehzeit zu einer Haltestelle einer Verbindung, in Minuten
+WALK_MINUTES = vol.All(vol.Coerce(int), vol.Range(min=0, max=60))
+
 
 class ExampleConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
     """Handle a config flow for Example Integration."""
@@ -28,19 +38,45 @@ class ExampleConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
         self.selected_station_id = None
         self.selected_station_name = None
         self.serving_lines = []
+        self.journey_name = None
+        self.journey_members = []
 
     async def async_step_user(
         self, user_input: dict[str, Any] | None = None
+    ) -> config_entries.ConfigFlowResult:
+        """Einstieg: Haltestelle suchen oder Verbindung aus Haltestellen bilden"""
+        if not self._station_entries():
+            return await self.async_step_search(user_input)
+        return self.async_show_menu(step_id="user", menu_options=["search", "journey"])
+
+    def _station_entries(self) -> dict[str, config_entries.ConfigEntry]:
+        """Vorhandene Haltestellen-Entries (ohne Verbindungen)."""
+        return {
+            entry.entry_id: entry
+            for entry in self._async_current_entries()
+            if not entry.data.get("journey")
+        }
+
+    async def async_step_search(
+        self, user_input: dict[str, Any] | None = None
     ) -> config_entries.ConfigFlowResult:
         """Erster Schritt: Nutzer gibt einen Suchbegriff ein"""
         errors = {}
 
         if user_input is not None:
             self.search_name = user_input["stop_name"]
-            api = KVVApi(self.hass)
+            catalog = await async_get_catalog(self.hass)
 
             try:
-                self.found_points = await api.get_points_by_name(self.search_name)
+                # Katalog bei gleicher Suche, sonst Stopfinder. Der lokale
+                # Index kennt nur früher gefundene Haltestellen und dient
+                # nur als Ersatz, wenn der Stopfinder nicht erreichbar ist.
+                try:
+                    self.found_points = await catalog.async_get_points(self.search_name)
+                except Exception:
+                    self.found_points = catalog.search(self.search_name)
+                    if not self.found_points:
+                        raise
 
                 if not self.found_points:
                     errors["base"] = "no_points_found"
@@ -55,7 +91,7 @@ class ExampleConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
             {vol.Required("stop_name", default=self.search_name or ""): cv.string}
         )
 
-        return self.async_show_form(step_id="user", data_schema=schema, errors=errors)
+        return self.async_show_form(step_id="search", data_schema=schema, errors=errors)
 
     async def async_step_station(
         self, user_input=None
@@ -64,7 +100,7 @@ class ExampleConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
         errors = {}
 
         if not self.found_points:
-            return await self.async_step_user()
+            return await self.async_step_search()
 
         # Mapping von Name → ID
         station_mapping = {p["name"]: p["id"] for p in self.found_points}
@@ -104,56 +140,30 @@ class ExampleConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
         if not getattr(self, "selected_station_id", None):
             return self.async_abort(reason="station_not_set")
 
-        api = KVVApi(self.hass)
-
-        raw: list[dict] = []
+        lines: list[dict] = []
 
         try:
-            # ✅ RICHTIGE QUELLE
-            raw = await api.get_serving_lines(self.selected_station_id)
+            # ✅ RICHTIGE QUELLE (servingLines, über den lokalen Katalog)
+            catalog = await async_get_catalog(self.hass)
+            lines = await catalog.async_get_serving_lines(self.selected_station_id)
         except Exception as e:
             _LOGGER.error("Fehler beim Laden der Serving Lines: %s", e)
             errors["base"] = "api_error"
 
-        if not raw:
+        if not lines:
             errors["base"] = "no_lines_found"
 
         options: dict[str, str] = {}
         self._line_map: dict[str, dict] = {}
 
-        _LOGGER.info(
-            "RAW: %s",
-            raw,
-        )
-
-        for entry in raw:
-            mode = entry.get("mode", {})
-            diva = mode.get("diva", {})
-
-            line_id = diva.get("line")  # z.B. "22305"
-            dir_code = diva.get("dir")  # "H" / "R"
-
-            number = mode.get("number")  # "S5"
-            destination = mode.get("destination")  # "Wörth (Rhein)"
-
-            _LOGGER.info(
-                "KVV ConfigFlow: ausgewählte Linien: %s → %s %s %s",
-                number,
-                destination,
-                dir_code,
-                line_id,
-            )
-
-            if not all([line_id, dir_code, number, destination]):
-                continue
-
-            label = f"{number} → {destination}"
+        for line in lines:
+            label = f"{line['line']} → {line['destination']}"
             options[label] = label
 
             self._line_map[label] = {
-                "line": number,
-                "line_id": line_id,
-                "dir": dir_code,  # Richtungscode
+                "line": line["line"],
+                "line_id": line["line_id"],
+                "dir": line["dir"],  # Richtungscode
             }
 
         if not options:
@@ -179,6 +189,62 @@ class ExampleConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
             errors=errors,
         )
 
+    async def async_step_journey(
+        self, user_input: dict[str, Any] | None = None
+    ) -> config_entries.ConfigFlowResult:
+        """Verbindung: Name und beteiligte Haltestellen-Entries wählen"""
+        errors = {}
+        stations = self._station_entries()
+
+        if user_input is not None:
+            self.journey_name = user_input["name"]
+            self.journey_members = user_input["members"]
+            if not self.journey_members:
+                errors["base"] = "no_members"
+            else:
+                return await self.async_step_walk()
+
+        schema = vol.Schema(
+            {
+                vol.Required("name"): cv.string,
+                vol.Required("members"): cv.multi_select(
+                    {entry_id: entry.title for entry_id, entry in stations.items()}
+                ),
+            }
+        )
+        return self.async_show_form(
+            step_id="journey", data_schema=schema, errors=errors
+        )
+
+    async def async_step_walk(
+        self, user_input: dict[str, Any] | None = None
+    ) -> config_entries.ConfigFlowResult:
+        """Verbindung: Gehzeit zu jeder Haltestelle in Minuten"""
+        labels = member_labels(self.hass, self.journey_members)
+
+        if user_input is not None:
+            return self.async_create_entry(
+                title=f"KVV: {self.journey_name}",
+                data={
+                    "journey": True,
+                    "name": self.journey_name,
+                    "members": [
+                        {"entry_id": entry_id, "walk_minutes": user_input[label]}
+                        for entry_id, label in labels.items()
+                    ],
+                },
+            )
+
+        return self.async_show_form(
+            step_id="walk",
+            data_schema=vol.Schema(
+                {
+                    vol.Required(label, default=0): WALK_MINUTES
+                    for label in labels.values()
+                }
+            ),
+        )
+
     @staticmethod
     @callback
     def async_get_options_flow(config_entry):
@@ -195,12 +261,58 @@ class KVVOptionsFlowHandler(config_entries.OptionsFlow):
         """Liefert das aktuelle ConfigEntry."""
         return self.hass.config_entries.async_get_entry(self._entry_id)
 
+    async def _async_line_options(self) -> dict[str, dict]:
+        """Label → Linie für alle Linien der Haltestelle, aus dem Katalog."""
+        station_id = self.config_entry.data.get("station_id")
+        try:
+            catalog = await async_get_catalog(self.hass)
+            # Kopie: die Liste gehört dem Katalog
+            lines = list(await catalog.async_get_serving_lines(station_id))
+        except Exception as e:
+            _LOGGER.warning("Linien für die Optionen nicht verfügbar: %s", e)
+            lines = []
+        # Gewählte Linien immer anbieten, auch ohne Katalogeintrag
+        for line in entry_serving_lines(self.config_entry):
+            if not any(
+                (l["line_id"], l["dir"]) == (line["line_id"], line["dir"])
+                for l in lines
+            ):
+                lines.append({**line, "destination": line["dir"]})
+
+        return {
+            f"{line['line']} → {line['destination']}": {
+                "line": line["line"],
+                "line_id": line["line_id"],
+                "dir": line["dir"],
+            }
+            for line in lines
+        }
+
     async def async_step_init(self, user_input=None):
         """Zeigt die Optionsseite und verarbeitet Änderungen."""
+        if self.config_entry.data.get("journey"):
+            return await self.async_step_journey(user_input)
+
+        line_options = await self._async_line_options()
+
         if user_input is not None:
+            # Linien als Label gewählt, gespeichert wie in entry.data
+            user_input["serving_lines"] = [
+                line_options[label] for label in user_input.get("serving_lines", [])
+            ]
             # Speichere die neuen Optionen
             return self.async_create_entry(title="", data=user_input)
 
+        selected = {
+            (line["line_id"], line["dir"])
+            for line in entry_serving_lines(self.config_entry)
+        }
+        selected_labels = [
+            label
+            for label, line in line_options.items()
+            if (line["line_id"], line["dir"]) in selected
+        ]
+
         # Standardwert verwenden, falls noch nichts konfiguriert ist
         update_interval = self.config_entry.options.get(
             "update_interval", DEFAULT_UPDATE_INTERVAL
@@ -209,6 +321,7 @@ class KVVOptionsFlowHandler(config_entries.OptionsFlow):
         departure_limit = self.config_entry.options.get(
             "departure_limit", DEFAULT_ITEM_LIMIT
         )
+        options = self.config_entry.options
 
         return self.async_show_form(
             step_id="init",
@@ -222,10 +335,88 @@ class KVVOptionsFlowHandler(config_entries.OptionsFlow):
                         "departure_limit",
                         default=departure_limit,
                     ): vol.All(vol.Coerce(int), vol.Range(min=1, max=30)),
+                    vol.Optional(
+                        "serving_lines", default=selected_labels
+                    ): cv.multi_select({label: label for label in line_options}),
+                    vol.Required(
+                        "adaptive_polling",
+                        default=options.get("adaptive_polling", False),
+                    ): cv.boolean,
+                    vol.Required(
+                        "quiet_hours_start",
+                        default=options.get(
+                            "quiet_hours_start", DEFAULT_QUIET_HOURS_START
+                        ),
+                    ): vol.All(vol.Coerce(int), vol.Range(min=0, max=23)),
+                    vol.Required(
+                        "quiet_hours_end",
+                        default=options.get("quiet_hours_end", DEFAULT_QUIET_HOURS_END),
+                    ): vol.All(vol.Coerce(int), vol.Range(min=0, max=23)),
+                    vol.Required(
+                        "timestamp_state",
+                        default=options.get("timestamp_state", False),
+                    ): cv.boolean,
+                    vol.Required(
+                        "per_line_sensors",
+                        default=options.get("per_line_sensors", False),
+                    ): cv.boolean,
+                    vol.Required(
+                        "delay_sensors",
+                        default=options.get("delay_sensors", False),
+                    ): cv.boolean,
                 }
             ),
         )
 
+    async def async_step_journey(self, user_input=None):
+        """Optionen einer Verbindung: Limit und Gehzeiten."""
+        members = self.config_entry.data.get("members", [])
+        labels = member_labels(self.hass, [m["entry_id"] for m in members])
+        walk_minutes = self.config_entry.options.get("walk_minutes", {})
+
+        if user_input is not None:
+            return self.async_create_entry(
+                title="",
+                data={
+                    "departure_limit": user_input["departure_limit"],
+                    "walk_minutes": {
+                        entry_id: user_input[label]
+                        for entry_id, label in labels.items()
+                    },
+                },
+            )
+
+        schema = {
+            vol.Required(
+                "departure_limit",
+                default=self.config_entry.options.get(
+                    "departure_limit", DEFAULT_ITEM_LIMIT
+                ),
+            ): vol.All(vol.Coerce(int), vol.Range(min=1, max=30)),
+        }
+        for member in members:
+            schema[
+                vol.Required(
+                    labels[member["entry_id"]],
+                    default=walk_minutes.get(
+                        member["entry_id"], member["walk_minutes"]
+                    ),
+                )
+            ] = WALK_MINUTES
+        return self.async_show_form(step_id="journey", data_schema=vol.Schema(schema))
+
+
+def member_labels(hass: HomeAssistant, entry_ids: list[str]) -> dict[str, str]:
+    """entry_id → eindeutige Feldbezeichnung (Titel des Haltestellen-Entries)."""
+    labels: dict[str, str] = {}
+    for entry_id in entry_ids:
+        entry = hass.config_entries.async_get_entry(entry_id)
+        label = entry.title if entry is not None else entry_id
+        while label in labels.values():
+            label = f"{label} ({entry_id[:6]})"
+        labels[entry_id] = label
+    return labels
+
 
 class CannotConnect(HomeAssistantError):
     """Error to indicate we cannot connect."""
@@ -1,3 +1,57 @@
 DOMAIN = "kvv_departure_monitor"
 DEFAULT_UPDATE_INTERVAL = 30
 DEFAULT_ITEM_LIMIT = 10
+
+# Maximales Alter (Sekunden) gecachter API-Antworten je Endpunkt
+STOPFINDER_CACHE_TTL = 3600
+SERVING_LINES_CACHE_TTL = 600
+DEPARTURES_CACHE_TTL = 5
+API_CACHE_SIZE = 64
+# Gemerkte Antworten des Dienstes get_departures
+SERVICE_CACHE_TTL = 30
+
+# Lokaler Haltestellen-/Linienkatalog
+CATALOG_STORAGE_VERSION = 1
+CATALOG_MAX_AGE = 7 * 24 * 3600
+CATALOG_MAX_SEARCHES = 200
+CATALOG_SAVE_DELAY = 10
+# Letzte bekannte Abfahrten je Haltestelle, für den Start ohne Netzwerk
+SNAPSHOT_STORAGE_VERSION = 1
+SNAPSHOT_SAVE_DELAY = 30
+# Aus Abfragen gelernter Fahrplan
+TIMETABLE_STORAGE_VERSION = 1
+TIMETABLE_SAVE_DELAY = 300
+TIMETABLE_MAX_AGE_DAYS = 28
+# Verspätungsstatistik: Werte je Linie, Richtung und Wochenstunde
+DELAY_STORAGE_VERSION = 1
+DELAY_SAVE_DELAY = 600
+DELAY_SAMPLES = 30
+
+# Überabfrage bei Linienfiltern
+OVERFETCH_MARGIN = 1.5
+MAX_UPSTREAM_LIMIT = 60
+MAX_FETCH_PAGES = 3
+
+# Adaptives Polling
+DEFAULT_QUIET_HOURS_START = 1
+DEFAULT_QUIET_HOURS_END = 5
+ADAPTIVE_MIN_INTERVAL = 15
+ADAPTIVE_MAX_INTERVAL = 300
+QUIET_HOURS_INTERVAL = 900
+
+# Timeouts, Wiederholungen und Circuit Breaker der API
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 10
+MAX_RETRIES = 2
+RETRY_BASE_DELAY = 1
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_TIMEOUT = 60
+# Backoff der Coordinators bei anhaltenden Fehlern
+FAILURE_BACKOFF_MAX_INTERVAL = 600
+
+# Ratenbegrenzung aller Anfragen (pro Sekunde, Burst)
+REQUEST_RATE = 1.0
+REQUEST_BURST = 3
+
+# Anzahl Messwerte je Histogramm der Laufzeitmessung
+METRICS_WINDOW = 200
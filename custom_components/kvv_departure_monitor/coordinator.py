@@ -0,0 +1,523 @@
+"""Coordinator, der die Abfahrten einer Haltestelle für alle Entries abruft."""
+
+import logging
+import math
+import time
+from datetime import timedelta
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.update_coordinator import DataUpdateCoordinator
+from homeassistant.util import dt as dt_util
+from .const import (
+    DEFAULT_UPDATE_INTERVAL,
+    DEFAULT_ITEM_LIMIT,
+    OVERFETCH_MARGIN,
+    MAX_UPSTREAM_LIMIT,
+    MAX_FETCH_PAGES,
+    DEFAULT_QUIET_HOURS_START,
+    DEFAULT_QUIET_HOURS_END,
+    ADAPTIVE_MIN_INTERVAL,
+    ADAPTIVE_MAX_INTERVAL,
+    QUIET_HOURS_INTERVAL,
+    FAILURE_BACKOFF_MAX_INTERVAL,
+)
+from .api import KVVApi
+from .metrics import KVVMetrics
+from .resilience import backoff_delay
+from .scheduler import (
+    KVVRequestScheduler,
+    PRIORITY_BACKGROUND,
+    PRIORITY_USER,
+    request_priority,
+)
+from .snapshots import KVVDepartureSnapshots
+from .timetable import KVVTimetable
+from .delays import KVVDelayStats
+from .models import Departure
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def entry_serving_lines(entry: ConfigEntry) -> list[dict]:
+    """Linienfilter eines Entries: aus den Optionen, sonst aus der Einrichtung."""
+    if "serving_lines" in entry.options:
+        return entry.options["serving_lines"]
+    return entry.data.get("serving_lines") or []
+
+
+class KVVDataCoordinator(DataUpdateCoordinator):
+    """Koordiniert das Abrufen und Cachen der KVV-Abfahrtsdaten einer Haltestelle.
+
+    Alle Config Entries mit derselben Haltestelle teilen sich einen
+    Coordinator. Abgefragt wird einmal mit dem größten benötigten Limit,
+    die Linienfilter der einzelnen Entries werden lokal angewendet.
+
+    Listener werden nur benachrichtigt, wenn sich die Abfahrten (Linie,
+    Richtung, Plan- und Echtzeit) tatsächlich geändert haben.
+    """
+
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        api: KVVApi,
+        scheduler: KVVRequestScheduler,
+        metrics: KVVMetrics,
+        station_id: str,
+        snapshots: KVVDepartureSnapshots | None = None,
+        timetable: KVVTimetable | None = None,
+        delays: KVVDelayStats | None = None,
+    ):
+        self.api = api
+        self.scheduler = scheduler
+        self.metrics = metrics
+        self.station_id = station_id
+        self.snapshots = snapshots
+        self.timetable = timetable
+        self.delays = delays
+        self.subscribers: dict[str, ConfigEntry] = {}
+        # Gelernter Anteil der Abfahrten, die den Linienfilter passieren
+        self.selectivity = 1.0
+        # Zeitpunkt des letzten erfolgreichen Abrufs und Fehler in Folge
+        self.last_success: float | None = None
+        self.consecutive_failures = 0
+        self._base_interval = timedelta(seconds=DEFAULT_UPDATE_INTERVAL)
+        # (Basisintervall, adaptiv) der angemeldeten Entries
+        self._interval_options: tuple[int, bool] | None = None
+        # Priorität des nächsten Abrufs; Versatz des ersten geplanten Polls
+        self._priority = PRIORITY_BACKGROUND
+        self._phase_pending = True
+        # (Limit, Linien) des letzten Abrufs, None vor dem ersten
+        self._covered: tuple[int, frozenset | None] | None = None
+        # (Linien-ID, Richtung) → Abfahrten, neu aufgebaut bei jedem Abruf
+        self.by_line: dict[tuple, list[Departure]] = {}
+
+        super().__init__(
+            hass,
+            _LOGGER,
+            # Gehört keinem einzelnen Entry, sonst würde er beim Entladen
+            # des ersten Entries mit heruntergefahren.
+            config_entry=None,
+            name=f"KVV Departure Monitor {station_id}",
+            update_interval=timedelta(seconds=DEFAULT_UPDATE_INTERVAL),
+            # Unveränderte Abfahrtslisten erzeugen keinen neuen State
+            always_update=False,
+        )
+
+    @property
+    def departure_limit(self) -> int:
+        """Größtes Abfahrtslimit aller angemeldeten Entries."""
+        return max(
+            (
+                entry.options.get("departure_limit", DEFAULT_ITEM_LIMIT)
+                for entry in self.subscribers.values()
+            ),
+            default=DEFAULT_ITEM_LIMIT,
+        )
+
+    @property
+    def allowed_lines(self) -> list[dict] | None:
+        """Vereinigung der Linienfilter, None sobald ein Entry ungefiltert ist."""
+        lines: dict[tuple, dict] = {}
+        for entry in self.subscribers.values():
+            serving_lines = entry_serving_lines(entry)
+            if not serving_lines:
+                return None
+            for line in serving_lines:
+                lines.setdefault((line["line_id"], line["dir"]), line)
+        return list(lines.values()) or None
+
+    def add_subscriber(self, entry: ConfigEntry) -> bool:
+        """Meldet einen Entry an.
+
+        Gibt True zurück, wenn sich dadurch die Abfrage ändert und die
+        vorhandenen Daten für den neuen Entry nicht ausreichen.
+        """
+        self.subscribers[entry.entry_id] = entry
+        self._update_interval_from_subscribers()
+        return self._needs_refetch()
+
+    def update_subscriber(self, entry: ConfigEntry) -> bool:
+        """Übernimmt geänderte Optionen eines angemeldeten Entries.
+
+        Ein neues Intervall gilt sofort für den nächsten geplanten Abruf;
+        ändern sich nur Limit oder Linien, bleibt ein adaptives Intervall oder
+        Backoff bestehen. Gibt True zurück, wenn die vorhandenen Daten Limit
+        oder Linien nicht mehr abdecken; sonst genügt es, die Listener neu
+        filtern zu lassen.
+        """
+        self.subscribers[entry.entry_id] = entry
+        if self._update_interval_from_subscribers() and self._listeners:
+            self._schedule_refresh()
+        return self._needs_refetch()
+
+    def _query(self) -> tuple[int, frozenset | None]:
+        """Limit und Linienschlüssel, mit denen aktuell abgefragt wird."""
+        lines = self.allowed_lines
+        if lines is None:
+            return self.departure_limit, None
+        return self.departure_limit, frozenset((l["line_id"], l["dir"]) for l in lines)
+
+    def _needs_refetch(self) -> bool:
+        """True, wenn der letzte Abruf Limit oder Linien der Entries nicht abdeckt."""
+        if self._covered is None:
+            return True
+        limit, lines = self._query()
+        covered_limit, covered_lines = self._covered
+        if limit > covered_limit:
+            return True
+        if covered_lines is None:
+            return False
+        return lines is None or not lines <= covered_lines
+
+    def remove_subscriber(self, entry_id: str) -> bool:
+        """Meldet einen Entry ab. Gibt True zurück, wenn keiner mehr übrig ist."""
+        self.subscribers.pop(entry_id, None)
+        self._update_interval_from_subscribers()
+        return not self.subscribers
+
+    def _update_interval_from_subscribers(self) -> bool:
+        """Nutzt das kürzeste Aktualisierungsintervall aller Entries.
+
+        Das geplante Intervall wird nur neu bestimmt, wenn sich Basisintervall
+        oder adaptives Polling geändert haben. Gibt dann True zurück.
+        """
+        seconds = min(
+            (
+                entry.options.get("update_interval", DEFAULT_UPDATE_INTERVAL)
+                for entry in self.subscribers.values()
+            ),
+            default=DEFAULT_UPDATE_INTERVAL,
+        )
+        interval_options = (seconds, self.adaptive_polling)
+        if interval_options == self._interval_options:
+            return False
+        self._interval_options = interval_options
+        self._base_interval = timedelta(seconds=seconds)
+        if self.consecutive_failures:
+            self.update_interval = self._failure_interval()
+        elif self.adaptive_polling and self.data:
+            self.update_interval = self._adaptive_interval(self.data, time.time())
+        else:
+            self.update_interval = self._base_interval
+        return True
+
+    def restore_snapshot(self) -> bool:
+        """Übernimmt die zuletzt gespeicherten Abfahrten als Startdaten.
+
+        Ist der Snapshot jünger als das Abfrageintervall, noch vollständig und
+        mit einer Abfrage entstanden, die Limit und Linien der Entries abdeckt,
+        wird der erste Abruf erst zum regulären Zeitpunkt fällig, gemessen am
+        gespeicherten Abruf. So fragt ein Neustart oder Reload nicht alle
+        Haltestellen gleichzeitig ab. Gibt True zurück, wenn sofort abgerufen
+        werden muss.
+        """
+        snapshot = self.snapshots.get(self.station_id) if self.snapshots else None
+        if not snapshot or not snapshot[2]:
+            return True
+        fetched, covered, departures = snapshot
+        self._covered = covered
+        self.last_success = fetched
+        self.data = departures
+        self.by_line = self._index_by_line(departures)
+
+        if len(departures) < self.departure_limit or self._needs_refetch():
+            return True
+        now = time.time()
+        if self.adaptive_polling:
+            # Ab jetzt gerechnet, die Daten aber nie älter als das Höchstintervall
+            remaining = min(
+                self._adaptive_interval(departures, now).total_seconds(),
+                ADAPTIVE_MAX_INTERVAL - (now - fetched),
+            )
+        else:
+            remaining = self._base_interval.total_seconds() - (now - fetched)
+        if remaining <= 0:
+            return True
+        # Wird nach dem ersten Abruf wieder regulär gesetzt
+        self.update_interval = timedelta(seconds=remaining)
+        return False
+
+    @staticmethod
+    def _index_by_line(departures: list[Departure]) -> dict[tuple, list[Departure]]:
+        by_line: dict[tuple, list[Departure]] = {}
+        for departure in departures:
+            by_line.setdefault(departure.line_key, []).append(departure)
+        return by_line
+
+    def query(
+        self, line_keys: frozenset | None, start: float | None, limit: int
+    ) -> list[Departure] | None:
+        """Beantwortet eine Abfrage aus den vorhandenen Daten.
+
+        Gibt None zurück, wenn der letzte Abruf die Abfrage nicht abdeckt:
+        andere Linien, ein Zeitpunkt vor dem Abruf oder zu wenige Treffer.
+        """
+        if self._covered is None or not self.data or self.last_success is None:
+            return None
+        covered_lines = self._covered[1]
+        if covered_lines is not None and (
+            line_keys is None or not line_keys <= covered_lines
+        ):
+            return None
+        begin = time.time() if start is None else start
+        if begin < self.last_success:
+            return None
+
+        matches = [
+            d
+            for d in self.data
+            if not d.has_departed(begin)
+            and (line_keys is None or d.line_key in line_keys)
+        ]
+        if len(matches) < limit:
+            return None
+        return matches[:limit]
+
+    def departures_for(
+        self, entry: ConfigEntry, now: float | None = None, limited: bool = True
+    ) -> list[Departure]:
+        """Wendet Linienfilter und Limit eines Entries auf die Daten an.
+
+        Mit ``now`` werden bereits abgefahrene Einträge ausgelassen, mit
+        ``limited=False`` gilt nur der Linienfilter.
+        """
+        data = self.data or []
+        if now is not None:
+            data = [d for d in data if not d.has_departed(now)]
+        serving_lines = entry_serving_lines(entry)
+        if serving_lines:
+            allowed = {(l["line_id"], l["dir"]) for l in serving_lines}
+            data = [d for d in data if d.line_key in allowed]
+        if not limited:
+            return data
+        return data[: entry.options.get("departure_limit", DEFAULT_ITEM_LIMIT)]
+
+    async def async_request_refresh(self) -> None:
+        """Vom Benutzer angestoßene Aktualisierung, wird bevorzugt abgefragt."""
+        self._priority = PRIORITY_USER
+        await super().async_request_refresh()
+
+    async def async_request_background_refresh(self) -> None:
+        """Aktualisierung ohne Vorrang, z.B. wenn die Liste kurz wird."""
+        await super().async_request_refresh()
+
+    async def _async_update_data(self):
+        """Lädt aktuelle Abfahrtsdaten von der KVV-API."""
+        token = request_priority.set(self._priority)
+        self._priority = PRIORITY_BACKGROUND
+        try:
+            with self.metrics.timer(self.metrics_scope, "cycle_ms"):
+                departures = await self._async_update_departures()
+        finally:
+            request_priority.reset(token)
+        self.metrics.record(self.metrics_scope, "results", len(departures))
+
+        self.by_line = self._index_by_line(departures)
+
+        if self._phase_pending:
+            # Einmalig versetzen, damit nicht alle Coordinators gleichzeitig pollen
+            self._phase_pending = False
+            offset = self.scheduler.phase_offset(self.station_id)
+            self.update_interval += self._base_interval * offset
+        return departures
+
+    async def _async_update_departures(self):
+        """Abruf mit Rückfall auf die letzten Daten und Backoff bei Fehlern."""
+        query = self._query()
+        try:
+            departures = await self._async_fetch_departures()
+
+        except Exception as e:
+            self.consecutive_failures += 1
+            _LOGGER.error("Fehler beim Abrufen der Abfahrtsdaten: %s", e)
+            # Letzte gültige Daten weiter anzeigen statt die Tafel zu leeren;
+            # deren Alter zeigt der Sensor als Attribut an
+            now = time.time()
+            departures = [d for d in self.data or [] if not d.has_departed(now)]
+            departures = self._fill_from_timetable(departures, now)
+            # Wird vom DataUpdateCoordinator für die nächste Planung übernommen
+            self.update_interval = self._failure_interval()
+            return departures
+
+        self.consecutive_failures = 0
+        self._covered = query
+        self.last_success = time.time()
+        if self.snapshots is not None:
+            self.snapshots.update(self.station_id, self.last_success, query, departures)
+        if self.timetable is not None:
+            self.timetable.learn(self.station_id, departures)
+        if self.delays is not None:
+            self.delays.observe(self.station_id, departures, self.last_success)
+        if self.adaptive_polling:
+            self.update_interval = self._adaptive_interval(
+                departures, self.last_success
+            )
+        else:
+            self.update_interval = self._base_interval
+        return departures
+
+    def _fill_from_timetable(
+        self, departures: list[Departure], now: float
+    ) -> list[Departure]:
+        """Ergänzt die letzten Live-Daten um Planabfahrten aus dem Fahrplan.
+
+        Die ergänzten Abfahrten haben keine Echtzeit (realtime False) und
+        schließen an die letzte noch bekannte Abfahrt an.
+        """
+        wanted = self.departure_limit
+        if self.timetable is None or len(departures) >= wanted:
+            return departures
+
+        lines = self.allowed_lines
+        allowed = None if lines is None else {(l["line_id"], l["dir"]) for l in lines}
+        start = now
+        if departures and departures[-1].planned is not None:
+            start = max(now, departures[-1].planned)
+        seen = {(d.line_key, d.planned) for d in departures}
+        scheduled = self.timetable.scheduled(self.station_id, start, wanted, allowed)
+        extra = [d for d in scheduled if (d.line_key, d.planned) not in seen]
+        return (departures + extra)[:wanted]
+
+    @property
+    def metrics_scope(self) -> str:
+        """Bereich der Laufzeitmessung für diese Haltestelle."""
+        return f"station {self.station_id}"
+
+    @property
+    def last_update(self) -> str | None:
+        """Zeitpunkt des letzten erfolgreichen Abrufs (ISO 8601)."""
+        if self.last_success is None:
+            return None
+        return dt_util.utc_from_timestamp(self.last_success).isoformat()
+
+    @property
+    def data_age(self) -> int | None:
+        """Sekunden seit dem letzten erfolgreichen Abruf."""
+        if self.last_success is None:
+            return None
+        return int(time.time() - self.last_success)
+
+    def _failure_interval(self) -> timedelta:
+        """Exponentiell wachsendes Intervall mit Jitter nach Fehlern in Folge."""
+        base = self._base_interval.total_seconds()
+        seconds = backoff_delay(
+            self.consecutive_failures, base, FAILURE_BACKOFF_MAX_INTERVAL
+        )
+        return timedelta(seconds=max(base, seconds))
+
+    @property
+    def adaptive_polling(self) -> bool:
+        """Adaptives Polling nur, wenn alle Entries es eingeschaltet haben."""
+        return bool(self.subscribers) and all(
+            entry.options.get("adaptive_polling", False)
+            for entry in self.subscribers.values()
+        )
+
+    def _in_quiet_hours(self) -> bool:
+        """True, wenn gerade für alle Entries Ruhezeit ist."""
+        hour = dt_util.now().hour
+        for entry in self.subscribers.values():
+            start = entry.options.get("quiet_hours_start", DEFAULT_QUIET_HOURS_START)
+            end = entry.options.get("quiet_hours_end", DEFAULT_QUIET_HOURS_END)
+            if start <= end:
+                quiet = start <= hour < end
+            else:  # über Mitternacht, z.B. 23–5 Uhr
+                quiet = hour >= start or hour < end
+            if not quiet:
+                return False
+        return True
+
+    def _adaptive_interval(self, departures: list[Departure], now: float) -> timedelta:
+        """Nächstes Intervall aus Countdown, Echtzeitstatus und Ruhezeiten.
+
+        Abgefragt wird nach der halben Zeit bis zur nächsten Abfahrt, gerechnet
+        ab ``now``; reine Fahrplandaten ändern sich seltener und dürfen doppelt
+        so alt werden.
+        """
+        if self._in_quiet_hours():
+            return timedelta(seconds=QUIET_HOURS_INTERVAL)
+
+        countdowns = [
+            (countdown, d)
+            for d in departures
+            if (countdown := d.countdown_at(now)) is not None
+        ]
+        if not countdowns:
+            return timedelta(seconds=ADAPTIVE_MAX_INTERVAL)
+
+        countdown, nearest = min(countdowns, key=lambda item: item[0])
+        seconds = countdown * 60 / 2
+        if not nearest.realtime:
+            seconds *= 2
+        seconds = max(ADAPTIVE_MIN_INTERVAL, min(ADAPTIVE_MAX_INTERVAL, seconds))
+        return timedelta(seconds=seconds)
+
+    async def _async_fetch_departures(self) -> list[Departure]:
+        """Holt so viele Abfahrten, dass jeder Entry sein Limit erreicht.
+
+        Gezählt wird je Entry mit dessen eigenem Linienfilter, nicht über die
+        Vereinigung aller Filter. Bei Linienfiltern wird das Upstream-Limit
+        anhand der gelernten Trefferquote erhöht. Reicht das nicht, wird ab
+        der letzten gelesenen Abfahrt weitergeblättert, höchstens
+        MAX_FETCH_PAGES Anfragen lang.
+        """
+        wanted = self.departure_limit
+        allowed_lines = self.allowed_lines
+        if not allowed_lines:
+            upstream_limit = wanted
+        else:
+            upstream_limit = min(
+                MAX_UPSTREAM_LIMIT,
+                max(wanted, math.ceil(wanted / self.selectivity * OVERFETCH_MARGIN)),
+            )
+        departures: list[Departure] = []
+        seen: set[tuple] = set()
+        start = None
+
+        for _ in range(MAX_FETCH_PAGES):
+            page = await self.api.get_departure_page(
+                station_id=self.station_id,
+                limit=upstream_limit,
+                allowed_lines=allowed_lines,
+                start=start,
+            )
+            if allowed_lines and page.scanned:
+                self._learn_selectivity(len(page.departures) / page.scanned)
+
+            for departure in page.departures:
+                key = (departure.line_key, departure.planned)
+                if key not in seen:
+                    seen.add(key)
+                    departures.append(departure)
+
+            # Genug Treffer für jeden Entry, oder die Antwort war kürzer als angefragt
+            if not self._missing_per_entry(departures):
+                break
+            if page.scanned < upstream_limit or page.last_planned is None:
+                break
+            # Nächste Seite ab der letzten gelesenen Abfahrt; hängt die
+            # Startzeit fest (viele Abfahrten pro Minute), eine Minute weiter
+            if start is not None and page.last_planned <= start:
+                start += 60
+            else:
+                start = page.last_planned
+
+        return departures
+
+    def _missing_per_entry(self, departures: list[Departure]) -> int:
+        """Summe der Abfahrten, die den Entries bis zu ihrem Limit noch fehlen."""
+        missing = 0
+        for entry in self.subscribers.values():
+            limit = entry.options.get("departure_limit", DEFAULT_ITEM_LIMIT)
+            serving_lines = entry_serving_lines(entry)
+            if serving_lines:
+                allowed = {(l["line_id"], l["dir"]) for l in serving_lines}
+                found = sum(1 for d in departures if d.line_key in allowed)
+            else:
+                found = len(departures)
+            missing += max(0, limit - found)
+        return missing
+
+    def _learn_selectivity(self, ratio: float) -> None:
+        """Gleitender Mittelwert der Filter-Trefferquote."""
+        self.selectivity = max(0.05, 0.7 * self.selectivity + 0.3 * ratio)
@@ -0,0 +1,184 @@
+"""Verspätungs- und Ausfallstatistik je Haltestelle, Linie und Wochenstunde.
+
+Jede Abfahrt wird einmal erfasst, wenn sie die Abfahrtsliste verlässt, mit
+dem zuletzt gemeldeten Stand: Verspätung in Minuten oder Ausfall. Je
+(Haltestelle, Linie, Richtung, Stunde der Woche) bleiben nur die letzten
+DELAY_SAMPLES Werte, der Speicherbedarf ist damit fest begrenzt.
+"""
+
+import asyncio
+import time
+from collections import deque
+from datetime import datetime
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.storage import Store
+from .models import EFA_TIMEZONE, Departure
+from .const import DOMAIN, DELAY_STORAGE_VERSION, DELAY_SAVE_DELAY, DELAY_SAMPLES
+
+STORAGE_KEY = f"{DOMAIN}.delays"
+
+# Eine Abfahrt, die so kurz vor ihrer Zeit aus der Liste fällt, gilt als abgefahren
+_DEPARTED_MARGIN = 120
+
+
+async def async_get_delay_stats(hass: HomeAssistant) -> "KVVDelayStats":
+    """Liefert die gemeinsame, geladene Verspätungsstatistik."""
+    domain_data = hass.data.setdefault(DOMAIN, {})
+    stats = domain_data.get("delays")
+    if stats is None:
+        stats = domain_data["delays"] = KVVDelayStats(hass)
+    await stats.async_load()
+    return stats
+
+
+def _hour_of_week(timestamp: float) -> int:
+    dt = datetime.fromtimestamp(timestamp, EFA_TIMEZONE)
+    return dt.weekday() * 24 + dt.hour
+
+
+class KVVDelayStats:
+    """Ringpuffer der Verspätungen (Minuten, None für Ausfall) je Bucket."""
+
+    def __init__(self, hass: HomeAssistant):
+        self._store = Store(hass, DELAY_STORAGE_VERSION, STORAGE_KEY)
+        self._load_task: asyncio.Future | None = None
+        # (station, (Linien-ID, Richtung)) → Wochenstunde → letzte Werte
+        self._buckets: dict[tuple[str, tuple], dict[int, deque]] = {}
+        # (station, Linie, Wochenstunde) → Ergebnis von summary()
+        self._summaries: dict[tuple, dict] = {}
+        # station_id → (Linie, Planzeit) → zuletzt gesehener Stand
+        self._pending: dict[str, dict[tuple, Departure]] = {}
+
+    async def async_load(self) -> None:
+        """Lädt die Statistik einmalig aus dem Speicher."""
+        if self._load_task is None:
+            self._load_task = asyncio.ensure_future(self._async_load())
+        await self._load_task
+
+    async def _async_load(self) -> None:
+        data = await self._store.async_load()
+        if data:
+            # Gespeichert als "station|Linien-ID|Richtung|Wochenstunde"
+            for key, values in data.get("buckets", {}).items():
+                station, line_id, dir_code, hour = key.split("|")
+                hours = self._buckets.setdefault((station, (line_id, dir_code)), {})
+                hours[int(hour)] = deque(values, maxlen=DELAY_SAMPLES)
+            self._summaries.clear()
+
+    def _data_to_save(self) -> dict:
+        return {
+            "buckets": {
+                f"{station}|{line_id}|{dir_code}|{hour}": list(values)
+                for (station, (line_id, dir_code)), hours in self._buckets.items()
+                for hour, values in hours.items()
+            }
+        }
+
+    def observe(
+        self, station_id: str, departures: list[Departure], now: float | None = None
+    ) -> None:
+        """Verarbeitet die Abfahrten eines Abrufs.
+
+        Abfahrten, die seit dem letzten Abruf aus der Liste verschwunden und
+        fällig waren, werden mit ihrem letzten Stand erfasst. Ohne Echtzeit
+        gibt es keine Verspätung; solche Abfahrten zählen nur als Ausfall.
+        """
+        now = time.time() if now is None else now
+        current = {
+            (d.line_key, d.planned): d
+            for d in departures
+            if d.planned is not None and d.line_id is not None
+        }
+        recorded = False
+        for key, departure in self._pending.get(station_id, {}).items():
+            if key in current:
+                continue
+            if departure.departure_time > now + _DEPARTED_MARGIN:
+                # Durch Limit oder Filter verdrängt, nicht abgefahren
+                continue
+            if departure.cancelled:
+                value = None
+            elif departure.realtime and departure.actual is not None:
+                value = round((departure.actual - departure.planned) / 60)
+            else:
+                continue
+            hours = self._buckets.setdefault(
+                (station_id, (departure.line_id, str(departure.dir_code))), {}
+            )
+            hour = _hour_of_week(departure.planned)
+            bucket = hours.get(hour)
+            if bucket is None:
+                bucket = hours[hour] = deque(maxlen=DELAY_SAMPLES)
+            bucket.append(value)
+            recorded = True
+        self._pending[station_id] = current
+        if recorded:
+            self._forget_summaries(station_id)
+            self._store.async_delay_save(self._data_to_save, DELAY_SAVE_DELAY)
+
+    def _forget_summaries(self, station_id: str) -> None:
+        for key in [k for k in self._summaries if k[0] == station_id]:
+            del self._summaries[key]
+
+    def summary(
+        self,
+        station_id: str,
+        line_key: tuple | None = None,
+        hour_of_week: int | None = None,
+    ) -> dict:
+        """Mittelwert, p90 der Verspätung und Ausfallquote.
+
+        Ohne ``line_key`` über alle Linien, ohne ``hour_of_week`` über die
+        ganze Woche. Ergebnisse bleiben bis zur nächsten erfassten Abfahrt
+        der Haltestelle gemerkt.
+        """
+        if line_key is not None:
+            line_key = (line_key[0], str(line_key[1]))
+        cache_key = (station_id, line_key, hour_of_week)
+        result = self._summaries.get(cache_key)
+        if result is None:
+            result = self._summaries[cache_key] = self._summarize(
+                station_id, line_key, hour_of_week
+            )
+        return result
+
+    def _summarize(
+        self, station_id: str, line_key: tuple | None, hour_of_week: int | None
+    ) -> dict:
+        if line_key is not None:
+            lines = [self._buckets.get((station_id, line_key), {})]
+        else:
+            lines = [
+                hours
+                for (station, _), hours in self._buckets.items()
+                if station == station_id
+            ]
+        values: list = []
+        for hours in lines:
+            if hour_of_week is None:
+                for bucket in hours.values():
+                    values.extend(bucket)
+            else:
+                values.extend(hours.get(hour_of_week, ()))
+
+        if not values:
+            return {"samples": 0, "mean": None, "p90": None, "cancelled": None}
+        delays = sorted(v for v in values if v is not None)
+        result = {
+            "samples": len(values),
+            "mean": None,
+            "p90": None,
+            "cancelled": round(100 * (len(values) - len(delays)) / len(values), 1),
+        }
+        if delays:
+            result["mean"] = round(sum(delays) / len(delays), 1)
+            result["p90"] = delays[min(len(delays) - 1, int(len(delays) * 0.9))]
+        return result
+
+    def remove(self, station_id: str) -> None:
+        """Vergisst eine Haltestelle, die kein Entry mehr nutzt."""
+        self._pending.pop(station_id, None)
+        for key in [k for k in self._buckets if k[0] == station_id]:
+            del self._buckets[key]
+        self._forget_summaries(station_id)
+        self._store.async_delay_save(self._data_to_save, DELAY_SAVE_DELAY)
@@ -0,0 +1,38 @@
+"""Diagnosedaten der KVV-Integration."""
+
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import HomeAssistant
+from .const import DOMAIN
+
+
+async def async_get_config_entry_diagnostics(
+    hass: HomeAssistant, entry: ConfigEntry
+) -> dict:
+    """Laufzeitmessungen, Cache- und Breaker-Zustand für einen Entry."""
+    domain_data = hass.data[DOMAIN]
+    if entry.data.get("journey"):
+        return {"entry": {"data": dict(entry.data), "options": dict(entry.options)}}
+    coordinator = domain_data[entry.entry_id]["coordinator"]
+    api = domain_data["api"]
+
+    return {
+        "entry": {"data": dict(entry.data), "options": dict(entry.options)},
+        "station": {
+            "station_id": coordinator.station_id,
+            "subscribers": len(coordinator.subscribers),
+            "update_interval": coordinator.update_interval.total_seconds(),
+            "selectivity": round(coordinator.selectivity, 3),
+            "data_age": coordinator.data_age,
+            "consecutive_failures": coordinator.consecutive_failures,
+            "departures": len(coordinator.data or []),
+            "metrics": coordinator.metrics.summary(coordinator.metrics_scope),
+        },
+        "api": {
+            "cache": api.cache_info(),
+            "breakers": api.breaker_info(),
+            "metrics": {
+                endpoint: api.metrics.summary(endpoint)
+                for endpoint in ("stopfinder", "departure_monitor")
+            },
+        },
+    }
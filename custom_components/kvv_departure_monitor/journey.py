@@ -0,0 +1,71 @@
+"""Zusammengeführte Abfahrten mehrerer Haltestellen zu einem gemeinsamen Ziel.
+
+Eine Verbindung ("Journey") besteht aus mehreren Haltestellen-Entries mit je
+einer Gehzeit. Deren bereits zeitlich sortierte Abfahrten werden per k-Wege-
+Merge zusammengeführt; übrig bleiben die Abfahrten, die man nach der Gehzeit
+noch erreicht.
+"""
+
+import heapq
+from dataclasses import dataclass
+from itertools import islice
+from homeassistant.config_entries import ConfigEntry
+from .models import Departure
+
+
+@dataclass(frozen=True, slots=True)
+class JourneyStop:
+    """Ein Haltestellen-Entry einer Verbindung mit Gehzeit in Minuten."""
+
+    entry_id: str
+    stop_name: str
+    walk_minutes: int
+
+
+def journey_stops(entry: ConfigEntry, station_entries: dict[str, ConfigEntry]):
+    """Haltestellen einer Verbindung, Gehzeiten aus den Optionen, sonst der Einrichtung.
+
+    Nicht (mehr) vorhandene Haltestellen-Entries werden ausgelassen.
+    """
+    walk_minutes = entry.options.get("walk_minutes", {})
+    stops = []
+    for member in entry.data.get("members", []):
+        station_entry = station_entries.get(member["entry_id"])
+        if station_entry is None:
+            continue
+        stops.append(
+            JourneyStop(
+                entry_id=member["entry_id"],
+                stop_name=station_entry.data.get("stop_name", station_entry.title),
+                walk_minutes=walk_minutes.get(
+                    member["entry_id"], member["walk_minutes"]
+                ),
+            )
+        )
+    return stops
+
+
+def merge_reachable(
+    streams: list[tuple[JourneyStop, list[Departure]]], now: float, limit: int
+) -> list[tuple[JourneyStop, Departure]]:
+    """Die nächsten ``limit`` erreichbaren Abfahrten aller Haltestellen.
+
+    Erreichbar ist eine Abfahrt, wenn sie nicht ausfällt und frühestens nach
+    der Gehzeit zur Haltestelle abfährt. Die Eingaben sind je Haltestelle
+    nach Abfahrtszeit sortiert; gelesen wird nur so weit wie nötig.
+    """
+
+    def _reachable(stop: JourneyStop, departures: list[Departure]):
+        earliest = now + stop.walk_minutes * 60
+        for departure in departures:
+            departure_time = departure.departure_time
+            if departure_time is None or departure.cancelled:
+                continue
+            if departure_time >= earliest:
+                yield stop, departure
+
+    merged = heapq.merge(
+        *(_reachable(stop, departures) for stop, departures in streams),
+        key=lambda item: item[1].departure_time,
+    )
+    return list(islice(merged, limit))
@@ -0,0 +1,74 @@
+"""Laufzeitmessungen der API-Aufrufe und Coordinator-Zyklen."""
+
+import time
+from collections import deque
+from contextlib import contextmanager
+from homeassistant.core import HomeAssistant
+from .const import DOMAIN, METRICS_WINDOW
+
+
+def get_metrics(hass: HomeAssistant) -> "KVVMetrics":
+    """Liefert die gemeinsamen Messwerte aller Einträge."""
+    domain_data = hass.data.setdefault(DOMAIN, {})
+    metrics = domain_data.get("metrics")
+    if metrics is None:
+        metrics = domain_data["metrics"] = KVVMetrics()
+    return metrics
+
+
+class RollingHistogram:
+    """Die letzten `size` Messwerte einer Größe mit Kennzahlen."""
+
+    def __init__(self, size: int = METRICS_WINDOW):
+        self._values: deque[float] = deque(maxlen=size)
+
+    def add(self, value: float) -> None:
+        self._values.append(value)
+
+    def summary(self) -> dict:
+        if not self._values:
+            return {"count": 0}
+        values = sorted(self._values)
+        count = len(values)
+        return {
+            "count": count,
+            "mean": round(sum(values) / count, 2),
+            "p50": values[(count - 1) // 2],
+            "p90": values[min(count - 1, int(count * 0.9))],
+            "max": values[-1],
+        }
+
+
+class KVVMetrics:
+    """Histogramme je Bereich (Endpunkt oder Haltestelle) und Messgröße.
+
+    Zeiten werden in Millisekunden, Größen in Bytes bzw. Anzahl erfasst.
+    """
+
+    def __init__(self):
+        self._histograms: dict[str, dict[str, RollingHistogram]] = {}
+
+    def record(self, scope: str, name: str, value: float) -> None:
+        phases = self._histograms.setdefault(scope, {})
+        histogram = phases.get(name)
+        if histogram is None:
+            histogram = phases[name] = RollingHistogram()
+        histogram.add(round(value, 2))
+
+    @contextmanager
+    def timer(self, scope: str, name: str):
+        """Misst die Dauer des Blocks in Millisekunden."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(scope, name, (time.perf_counter() - start) * 1000)
+
+    def summary(self, scope: str) -> dict:
+        return {
+            name: histogram.summary()
+            for name, histogram in self._histograms.get(scope, {}).items()
+        }
+
+    def as_dict(self) -> dict:
+        return {scope: self.summary(scope) for scope in self._histograms}
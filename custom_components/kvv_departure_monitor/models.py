@@ -0,0 +1,194 @@
+"""Datenmodelle der KVV-Integration."""
+
+import sys
+from dataclasses import dataclass, field
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+# Zeitangaben der EFA sind Ortszeit des Verkehrsverbunds
+EFA_TIMEZONE = ZoneInfo("Europe/Berlin")
+# Wert von servingLine.delay für ausgefallene Fahrten
+CANCELLED_DELAY = "-9999"
+
+
+def _intern(value):
+    """Interniert wiederkehrende Strings (Linien, Richtungen) über alle Abfragen."""
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def _flag(value) -> bool:
+    """Wertet EFA-Flags aus, die als "1"/"0" oder bool geliefert werden."""
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true")
+    return bool(value)
+
+
+def _int_or_none(value) -> int | None:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_efa_datetime(value) -> float | None:
+    """Wandelt ein EFA-dateTime-Objekt in einen Unix-Zeitstempel um."""
+    if not isinstance(value, dict):
+        return None
+    try:
+        return datetime(
+            int(value["year"]),
+            int(value["month"]),
+            int(value["day"]),
+            int(value["hour"]),
+            int(value["minute"]),
+            tzinfo=EFA_TIMEZONE,
+        ).timestamp()
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def format_efa_datetime(timestamp: float | None) -> dict | None:
+    """Erzeugt aus einem Zeitstempel die dateTime-Form der EFA.
+
+    Wie bei der EFA ohne führende Nullen, Wochentag 1 = Sonntag.
+    """
+    if timestamp is None:
+        return None
+    dt = datetime.fromtimestamp(timestamp, EFA_TIMEZONE)
+    return {
+        "year": str(dt.year),
+        "month": str(dt.month),
+        "day": str(dt.day),
+        "weekday": str(dt.isoweekday() % 7 + 1),
+        "hour": str(dt.hour),
+        "minute": str(dt.minute),
+    }
+
+
+@dataclass(frozen=True, slots=True)
+class Departure:
+    """Eine Abfahrt an einer Haltestelle.
+
+    Zeiten werden als Unix-Zeitstempel gehalten; die Attribut-Form mit
+    verschachtelten dateTime-Objekten entsteht erst in ``as_dict``.
+    Der Countdown zählt nicht zum Vergleich: er wird lokal aus den
+    Zeitstempeln berechnet und ändert sich, ohne dass sich die Abfahrt ändert.
+    """
+
+    line: str
+    line_id: str | None
+    dir_code: str | None
+    direction: str
+    countdown: int | None = field(compare=False)
+    realtime: bool
+    planned: float | None
+    actual: float | None
+    # servingLine.delay == "-9999" markiert einen Ausfall
+    cancelled: bool = False
+
+    @classmethod
+    def from_efa(cls, dep: dict) -> "Departure":
+        """Erzeugt eine Abfahrt aus einem departureList-Eintrag."""
+        serving = dep.get("servingLine", {})
+        proj = serving.get("liErgRiProj", {})
+        return cls(
+            line=_intern(serving.get("number", "?")),
+            line_id=_intern(proj.get("line")),
+            dir_code=_intern(proj.get("direction")),
+            direction=_intern(serving.get("direction", "Unbekannt")),
+            countdown=_int_or_none(dep.get("countdown")),
+            realtime=_flag(dep.get("realtime", False)),
+            planned=parse_efa_datetime(dep.get("dateTime")),
+            actual=parse_efa_datetime(dep.get("realDateTime")),
+            cancelled=str(serving.get("delay")) == CANCELLED_DELAY,
+        )
+
+    @classmethod
+    def from_storage(cls, item: list) -> "Departure":
+        """Gegenstück zu ``as_storage``."""
+        line, line_id, dir_code, direction = map(_intern, item[:4])
+        countdown, realtime, planned, actual, cancelled = item[4:9]
+        return cls(
+            line=line,
+            line_id=line_id,
+            dir_code=dir_code,
+            direction=direction,
+            countdown=countdown,
+            realtime=realtime,
+            planned=planned,
+            actual=actual,
+            cancelled=cancelled,
+        )
+
+    def as_storage(self) -> list:
+        """Kompakte Listenform für den Speicher."""
+        return [
+            self.line,
+            self.line_id,
+            self.dir_code,
+            self.direction,
+            self.countdown,
+            self.realtime,
+            self.planned,
+            self.actual,
+            self.cancelled,
+        ]
+
+    @property
+    def line_key(self) -> tuple:
+        """(Linien-ID, Richtungscode) wie in den serving_lines der Entries."""
+        return (self.line_id, self.dir_code)
+
+    @property
+    def departure_time(self) -> float | None:
+        """Voraussichtliche Abfahrt: Echtzeit, sonst Fahrplan."""
+        return self.actual if self.actual is not None else self.planned
+
+    def countdown_at(self, now: float) -> int | None:
+        """Minuten bis zur Abfahrt, lokal aus dem Zeitstempel berechnet."""
+        departure_time = self.departure_time
+        if departure_time is None:
+            return self.countdown
+        return max(0, int((departure_time - now) // 60))
+
+    def has_departed(self, now: float) -> bool:
+        """True, wenn die Abfahrtsminute vorbei ist."""
+        departure_time = self.departure_time
+        return departure_time is not None and now >= departure_time + 60
+
+    @property
+    def planned_datetime(self) -> datetime | None:
+        """Planmäßige Abfahrt als Ortszeit."""
+        if self.planned is None:
+            return None
+        return datetime.fromtimestamp(self.planned, EFA_TIMEZONE)
+
+    def as_dict(self, now: float | None = None) -> dict:
+        """Attribut-Form einer Abfahrt, wie sie die Sensoren bisher liefern.
+
+        Der Countdown ist wie bei der EFA ein String, mit ``now`` auf diesen
+        Zeitpunkt umgerechnet.
+        """
+        countdown = self.countdown if now is None else self.countdown_at(now)
+        return {
+            "line": self.line,
+            "direction": self.direction,
+            "countdown": "?" if countdown is None else str(countdown),
+            "realtime": self.realtime,
+            "dateTime": format_efa_datetime(self.planned),
+            "realDateTime": format_efa_datetime(self.actual),
+        }
+
+
+@dataclass(slots=True)
+class DeparturePage:
+    """Ergebnis einer einzelnen Abfahrtsabfrage.
+
+    Neben den passenden Abfahrten wird festgehalten, wie viele Einträge die
+    Antwort insgesamt enthielt und wann der letzte davon planmäßig abfuhr –
+    daraus ergeben sich Filter-Trefferquote und Startzeit der Folgeseite.
+    """
+
+    departures: list[Departure]
+    scanned: int = 0
+    last_planned: float | None = None
@@ -0,0 +1,67 @@
+"""Backoff und Circuit Breaker für die Anfragen an die KVV-EFA."""
+
+import random
+import time
+
+
+def backoff_delay(attempt: int, base: float, maximum: float | None = None) -> float:
+    """Exponentielle Wartezeit mit Jitter ("full jitter") für Versuch `attempt`."""
+    delay = base * 2**attempt
+    if maximum is not None:
+        delay = min(delay, maximum)
+    return random.uniform(delay / 2, delay)
+
+
+class CircuitBreaker:
+    """Sperrt einen Endpunkt nach wiederholten Fehlern für eine Weile.
+
+    Nach `failure_threshold` Fehlern in Folge ist der Breaker offen und lässt
+    keine Anfragen durch. Nach `reset_timeout` Sekunden darf eine einzelne
+    Probeanfrage durch; gelingt sie, schließt er wieder, sonst bleibt er offen.
+    """
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: float | None = None
+        self._trial_started: float | None = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow_request(self) -> bool:
+        """True, wenn eine Anfrage an den Endpunkt gestellt werden darf."""
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "open":
+            return False
+
+        # Halb offen: nur eine Probeanfrage; hängt sie, verfällt sie nach
+        # reset_timeout und die nächste darf es versuchen
+        now = time.monotonic()
+        if (
+            self._trial_started is not None
+            and now - self._trial_started < self.reset_timeout
+        ):
+            return False
+        self._trial_started = now
+        return True
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._trial_started = None
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self._trial_started is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            self._trial_started = None
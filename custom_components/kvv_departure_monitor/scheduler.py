@@ -0,0 +1,105 @@
+"""Domänenweiter Scheduler für Anfragen an die KVV-EFA.
+
+Begrenzt die Anfragerate mit einem Token Bucket, bevorzugt vom Benutzer
+ausgelöste Anfragen vor Hintergrund-Polls und verteilt die Polls der
+Coordinators über das Intervall.
+"""
+
+import asyncio
+import heapq
+import itertools
+import time
+from contextvars import ContextVar
+from homeassistant.core import HomeAssistant
+from .const import DOMAIN, REQUEST_RATE, REQUEST_BURST
+
+PRIORITY_USER = 0
+PRIORITY_BACKGROUND = 1
+
+# Priorität der Anfragen im aktuellen Kontext; Coordinators setzen sie
+# für ihre Polls auf PRIORITY_BACKGROUND
+request_priority: ContextVar[int] = ContextVar(
+    "kvv_request_priority", default=PRIORITY_USER
+)
+
+# Goldener Schnitt: aufeinanderfolgende Slots landen gleichmäßig verteilt
+# im Intervall, egal wie viele Coordinators es am Ende werden
+_GOLDEN_RATIO = (5**0.5 - 1) / 2
+
+
+def get_scheduler(hass: HomeAssistant) -> "KVVRequestScheduler":
+    """Liefert den gemeinsamen Scheduler aller Einträge."""
+    domain_data = hass.data.setdefault(DOMAIN, {})
+    scheduler = domain_data.get("scheduler")
+    if scheduler is None:
+        scheduler = domain_data["scheduler"] = KVVRequestScheduler(
+            REQUEST_RATE, REQUEST_BURST
+        )
+    return scheduler
+
+
+class KVVRequestScheduler:
+    """Token Bucket mit Prioritäts-Warteschlange."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+        self._wakeup: asyncio.TimerHandle | None = None
+        self._phase_slots: dict[str, int] = {}
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, priority: int | None = None) -> None:
+        """Wartet, bis eine Anfrage gestellt werden darf."""
+        if priority is None:
+            priority = request_priority.get()
+
+        self._refill()
+        if not self._waiters and self._tokens >= 1:
+            self._tokens -= 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        self._schedule_wakeup()
+        await future
+
+    def _schedule_wakeup(self) -> None:
+        if self._wakeup is not None or not self._waiters:
+            return
+        delay = max(0.0, (1 - self._tokens) / self.rate)
+        self._wakeup = asyncio.get_running_loop().call_later(delay, self._release)
+
+    def _release(self) -> None:
+        """Gibt wartende Anfragen in Prioritätsreihenfolge frei."""
+        self._wakeup = None
+        self._refill()
+        while self._waiters and self._tokens >= 1:
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():  # Aufrufer inzwischen abgebrochen
+                continue
+            self._tokens -= 1
+            future.set_result(None)
+        self._schedule_wakeup()
+
+    def phase_offset(self, key: str) -> float:
+        """Fester Anteil (0–1) des Intervalls, um den `key` versetzt pollt.
+
+        Neue Keys bekommen den kleinsten freien Slot.
+        """
+        slot = self._phase_slots.get(key)
+        if slot is None:
+            used = set(self._phase_slots.values())
+            slot = next(n for n in itertools.count() if n not in used)
+            self._phase_slots[key] = slot
+        return (slot * _GOLDEN_RATIO) % 1
+
+    def release_phase(self, key: str) -> None:
+        self._phase_slots.pop(key, None)
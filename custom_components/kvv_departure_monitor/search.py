@@ -0,0 +1,124 @@
+"""Lokaler Suchindex für Haltestellennamen.
+
+Namen werden normalisiert (Kleinschreibung, Umlaute/ß ausgeschrieben,
+Satzzeichen entfernt). Gesucht wird zuerst über Wortpräfixe in einer
+sortierten Wortliste, bei keinem Treffer unscharf über Trigramme, damit
+Tippfehler trotzdem zum Ziel führen.
+"""
+
+from bisect import bisect_left
+import re
+
+_REPLACEMENTS = str.maketrans({"ä": "ae", "ö": "oe", "ü": "ue", "ß": "ss"})
+_NON_WORD = re.compile(r"[^0-9a-z]+")
+
+# Mindestanteil der Trigramme jedes Suchworts, die ein Wort des unscharfen
+# Treffers enthalten muss
+FUZZY_THRESHOLD = 0.6
+
+
+def normalize(text: str) -> str:
+    """Normalisiert z.B. "Karlsruhe, Marktplatz (U)" zu "karlsruhe marktplatz u"."""
+    text = text.casefold().translate(_REPLACEMENTS)
+    return " ".join(_NON_WORD.sub(" ", text).split())
+
+
+def _trigrams(text: str) -> set[str]:
+    padded = f"  {text} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+class StationIndex:
+    """Präfix- und Trigramm-Index über Haltestellen (id → Name)."""
+
+    def __init__(self):
+        self._names: dict[str, str] = {}
+        self._normalized: dict[str, str] = {}
+        self._words: list[tuple[str, str]] = []  # sortiert: (Wort, id)
+        self._trigrams: dict[str, set[str]] = {}
+        self._dirty = False
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def add(self, points: list[dict]) -> None:
+        """Nimmt Stopfinder-Treffer ({name, id}) auf."""
+        for point in points:
+            station_id, name = point["id"], point["name"]
+            if self._names.get(station_id) == name:
+                continue
+            self._names[station_id] = name
+            normalized = self._normalized[station_id] = normalize(name)
+            for gram in _trigrams(normalized):
+                self._trigrams.setdefault(gram, set()).add(station_id)
+            self._dirty = True
+
+    def _word_list(self) -> list[tuple[str, str]]:
+        # Sortierte Wortliste erst bei der nächsten Suche neu aufbauen
+        if self._dirty:
+            self._words = sorted(
+                (word, station_id)
+                for station_id, normalized in self._normalized.items()
+                for word in normalized.split()
+            )
+            self._dirty = False
+        return self._words
+
+    def _prefix_matches(self, prefix: str) -> set[str]:
+        words = self._word_list()
+        matches = set()
+        i = bisect_left(words, (prefix, ""))
+        while i < len(words) and words[i][0].startswith(prefix):
+            matches.add(words[i][1])
+            i += 1
+        return matches
+
+    def search(self, query: str, limit: int = 20) -> list[dict]:
+        """Haltestellen zu einem Suchbegriff, beste Treffer zuerst."""
+        normalized = normalize(query)
+        if not normalized:
+            return []
+
+        # Jedes Suchwort muss Präfix eines Wortes im Namen sein
+        candidates = None
+        for token in normalized.split():
+            matches = self._prefix_matches(token)
+            candidates = matches if candidates is None else candidates & matches
+            if not candidates:
+                break
+
+        if candidates:
+            ranked = sorted(
+                candidates,
+                key=lambda i: (
+                    not self._normalized[i].startswith(normalized),
+                    len(self._normalized[i]),
+                    self._normalized[i],
+                ),
+            )
+        else:
+            ranked = self._fuzzy(normalized)
+
+        return [{"name": self._names[i], "id": i} for i in ranked[:limit]]
+
+    def _fuzzy(self, normalized: str) -> list[str]:
+        """Unscharfe Suche: jedes Suchwort muss einem Wort im Namen ähneln.
+
+        Über den ganzen Begriff gezählte Trigramme würden gemeinsame Wörter
+        ("karlsruhe", "platz") allein schon als Treffer werten.
+        """
+        tokens = [_trigrams(token) for token in normalized.split()]
+        candidates: set[str] = set()
+        for gram in _trigrams(normalized):
+            candidates.update(self._trigrams.get(gram, ()))
+
+        scored = []
+        for station_id in candidates:
+            words = [_trigrams(word) for word in self._normalized[station_id].split()]
+            score = min(
+                max(len(grams & word) / len(grams) for word in words)
+                for grams in tokens
+            )
+            if score >= FUZZY_THRESHOLD:
+                scored.append((-score, len(self._normalized[station_id]), station_id))
+        return [station_id for _, _, station_id in sorted(scored)]
@@ -1,123 +1,435 @@
 import logging
+import time
+from abc import abstractmethod
 from datetime import timedelta
-from homeassistant.components.sensor import SensorEntity
-from homeassistant.helpers.update_coordinator import (
-    DataUpdateCoordinator,
-    CoordinatorEntity,
+from homeassistant.components.sensor import (
+    SensorDeviceClass,
+    SensorEntity,
+    SensorStateClass,
 )
-from homeassistant.core import HomeAssistant
+from homeassistant.const import EntityCategory, PERCENTAGE, UnitOfTime
+from homeassistant.helpers.update_coordinator import CoordinatorEntity
+from homeassistant.core import CALLBACK_TYPE, HomeAssistant, callback
 from homeassistant.config_entries import ConfigEntry
-from .const import DOMAIN, DEFAULT_UPDATE_INTERVAL, DEFAULT_ITEM_LIMIT
-from .api import KVVApi
+from homeassistant.helpers.event import async_track_time_change
+from homeassistant.util import dt as dt_util
+from .const import DOMAIN, DEFAULT_ITEM_LIMIT
+from .coordinator import KVVDataCoordinator, entry_serving_lines
+from .journey import JourneyStop, journey_stops, merge_reachable
+from .models import Departure
 
 _LOGGER = logging.getLogger(__name__)
 
+# Nur der Diagnosesensor pollt; er liest lediglich die lokalen Messwerte
+SCAN_INTERVAL = timedelta(seconds=60)
+
 
 async def async_setup_entry(
     hass: HomeAssistant, entry: ConfigEntry, async_add_entities
 ):
     """Setzt die Sensorplattform für die KVV-Integration auf."""
 
-    stored_data = hass.data[DOMAIN][entry.entry_id]
-    api = stored_data["api"]
-    coordinator = stored_data.get("coordinator")
+    if entry.data.get("journey"):
+        async_add_entities([KVVJourneySensor(entry)])
+        return
 
-    if not coordinator:
-        station_id = entry.data.get("station_id")
-        coordinator = KVVDataCoordinator(hass, api, station_id, entry)
-        await coordinator.async_config_entry_first_refresh()
-        hass.data[DOMAIN][entry.entry_id]["coordinator"] = coordinator
+    coordinator = hass.data[DOMAIN][entry.entry_id]["coordinator"]
+    if entry.options.get("timestamp_state", False):
+        departure_sensor = KVVDepartureTimestampSensor(coordinator, entry)
+    else:
+        departure_sensor = KVVDepartureSensor(coordinator, entry)
+    entities = [
+        departure_sensor,
+        KVVRefreshDurationSensor(coordinator, entry),
+    ]
+    if entry.options.get("per_line_sensors", False):
+        entities.extend(
+            KVVLineDepartureSensor(coordinator, entry, line)
+            for line in entry_serving_lines(entry)
+        )
+    if entry.options.get("delay_sensors", False) and coordinator.delays is not None:
+        # Ungefilterte Entries bekommen die Statistik über alle Linien
+        for line in entry_serving_lines(entry) or [None]:
+            entities.extend(
+                KVVDelaySensor(coordinator, entry, line, kind)
+                for kind in KVVDelaySensor.KINDS
+            )
+    async_add_entities(entities)
 
-    async_add_entities([KVVDepartureSensor(coordinator, entry)])
 
+class KVVDepartureEntity(CoordinatorEntity, SensorEntity):
+    """Gemeinsame Basis der Abfahrtssensoren: Anzeige und lokaler Countdown.
 
-class KVVDataCoordinator(DataUpdateCoordinator):
-    """Koordiniert das Abrufen und Cachen der KVV-Abfahrtsdaten."""
+    Die Abfahrtsliste mit ihren Countdowns wird nicht aufgezeichnet; der
+    minütliche Tick schreibt nur, wenn sich der State selbst ändert.
+    """
 
-    def __init__(
-        self, hass: HomeAssistant, api: KVVApi, station_id: str, entry: ConfigEntry
-    ):
-        self.api = api
-        self.station_id = station_id
-        self.entry = entry
+    _unrecorded_attributes = frozenset({"abfahrten", "last_update"})
 
-        update_interval = timedelta(
-            seconds=entry.options.get("update_interval", DEFAULT_UPDATE_INTERVAL)
-        )
+    def __init__(self, coordinator: KVVDataCoordinator, entry: ConfigEntry):
+        super().__init__(coordinator)
+        self._entry = entry
+        self._stop_name = entry.data.get("stop_name", "Unbekannt")
+        # Anzahl Abfahrten direkt nach dem letzten Abruf
+        self._fetched_count = 0
+        # Zuletzt geschriebener State-Text
+        self._shown_text: str | None = None
 
-        super().__init__(
-            hass,
-            _LOGGER,
-            name=f"KVV Departure Monitor {station_id}",
-            update_interval=update_interval,
-        )
+    @abstractmethod
+    def _departures(self, now: float | None = None) -> list[Departure]:
+        """Abfahrten dieses Sensors, mit ``now`` ohne bereits abgefahrene."""
 
-    async def _async_update_data(self):
-        """Lädt aktuelle Abfahrtsdaten von der KVV-API."""
-        try:
-            # lines = self.config_entry.data.get("serving_lines")
-            limit = self.config_entry.options.get(
-                "departure_limit",
-                DEFAULT_ITEM_LIMIT,
-            )
-            # _LOGGER.info(
-            #     "Rufe Abfahrtsdaten für Station %s mit Linien %s ab",
-            #     self.station_id,
-            #     lines,
-            #     limit,
-            # )
-            departures = await self.api.get_departures_by_station_id(
-                station_id=self.station_id,
-                limit=limit,
-                allowed_lines=self.config_entry.data.get("serving_lines"),
-            )
-            # _LOGGER.info(
-            #     "Gefilterte Abfahrtsdaten für Station %s: %s",
-            #     self.station_id,
-            #     departures,
-            # )
+    async def async_added_to_hass(self) -> None:
+        """Startet den minütlichen lokalen Countdown."""
+        await super().async_added_to_hass()
+        self._fetched_count = len(self._departures())
+        self.async_on_remove(
+            async_track_time_change(self.hass, self._async_tick, second=0)
+        )
 
-            return departures
+    @callback
+    def _handle_coordinator_update(self) -> None:
+        self._fetched_count = len(self._departures())
+        super()._handle_coordinator_update()
 
-        except Exception as e:
-            _LOGGER.error("Fehler beim Abrufen der Abfahrtsdaten: %s", e)
-            return []
+    async def _async_tick(self, _now) -> None:
+        """Rechnet Countdowns ohne Netzwerkzugriff neu.
 
+        Erst wenn seit dem letzten Abruf Abfahrten weggefallen sind und die
+        Liste dadurch kürzer als das Limit ist, wird neu geladen.
+        """
+        now = time.time()
+        if self._tick_changes_state(now):
+            self.async_write_ha_state()
+        limit = self._entry.options.get("departure_limit", DEFAULT_ITEM_LIMIT)
+        remaining = len(self._departures(now))
+        if remaining < min(limit, self._fetched_count):
+            await self.coordinator.async_request_background_refresh()
 
-class KVVDepartureSensor(CoordinatorEntity, SensorEntity):
-    """Repräsentiert einen Sensor für KVV-Abfahrten."""
+    def _tick_changes_state(self, now: float) -> bool:
+        """True, wenn der minütliche Tick den State neu schreiben muss."""
+        return self._display_text(now) != self._shown_text
 
-    def __init__(self, coordinator: KVVDataCoordinator, entry: ConfigEntry):
-        super().__init__(coordinator)
-        self._stop_name = entry.data.get("stop_name", "Unbekannt")
-        self._attr_name = f"KVV Abfahrten {entry.data.get('stop_name', 'Unbekannt')}"
-        self._attr_unique_id = f"{entry.entry_id}_departures"
-
-    @property
-    def native_value(self):
-        """Gibt die nächste Abfahrtszeit zurück."""
-        data = self.coordinator.data
+    def _display_text(self, now: float, with_countdown: bool = True) -> str:
+        """Formatierte nächste Abfahrt, z.B. "S5 → Durlach 10:24 in 2 Min"."""
+        data = self._departures(now)
         if not data:
             return "Keine Daten"
 
         first_departure = data[0]
         # dateTime nutzen, falls vorhanden
-        dt = first_departure.get("dateTime")
-        hour = str(dt.get("hour", "??")).zfill(2)
-        minute = str(dt.get("minute", "??")).zfill(2)
-        countdown = first_departure.get("countdown")
-        line = first_departure.get("line", "?")
-        direction = first_departure.get("direction", "?")
+        dt = first_departure.planned_datetime
+        clock = f"{dt:%H:%M}" if dt else "??:??"
+        countdown = first_departure.countdown_at(now)
+        line = first_departure.line
+        direction = first_departure.direction
+        if not with_countdown:
+            return f"{line} → {direction} {clock}"
         if countdown is not None:
-            return f"{line} → {direction} {hour}:{minute} in {countdown} Min"
+            return f"{line} → {direction} {clock} in {countdown} Min"
 
         _LOGGER.warning("Unbekanntes Abfahrtsformat: %s", first_departure)
         return "Unbekannt"
 
+    @property
+    def native_value(self):
+        """Gibt die nächste Abfahrtszeit zurück."""
+        self._shown_text = self._display_text(time.time())
+        return self._shown_text
+
     @property
     def extra_state_attributes(self):
         """Gibt zusätzliche Infos über die nächsten Abfahrten zurück."""
+        now = time.time()
         return {
             "station_name": self._stop_name,
-            "abfahrten": self.coordinator.data or [],
+            # Ändert sich nur mit einem Abruf, anders als ein Alter in Sekunden
+            "last_update": self.coordinator.last_update,
+            "abfahrten": [
+                departure.as_dict(now) for departure in self._departures(now)
+            ],
         }
+
+
+class KVVDepartureSensor(KVVDepartureEntity):
+    """Repräsentiert einen Sensor für KVV-Abfahrten."""
+
+    def __init__(self, coordinator: KVVDataCoordinator, entry: ConfigEntry):
+        super().__init__(coordinator, entry)
+        self._attr_name = f"KVV Abfahrten {entry.data.get('stop_name', 'Unbekannt')}"
+        self._attr_unique_id = f"{entry.entry_id}_departures"
+
+    def _departures(self, now: float | None = None) -> list[Departure]:
+        return self.coordinator.departures_for(self._entry, now)
+
+
+class KVVDepartureTimestampSensor(KVVDepartureSensor):
+    """Sensor mit der nächsten Abfahrt als Zeitstempel.
+
+    Der State ändert sich nur, wenn sich die nächste Abfahrt ändert; den
+    Countdown rechnet das Frontend selbst. Die Abfahrtsliste wird nicht
+    aufgezeichnet.
+    """
+
+    _attr_device_class = SensorDeviceClass.TIMESTAMP
+
+    def __init__(self, coordinator: KVVDataCoordinator, entry: ConfigEntry):
+        super().__init__(coordinator, entry)
+        self._shown: Departure | None = None
+
+    def _next_departure(self, now: float) -> Departure | None:
+        data = self._departures(now)
+        return data[0] if data else None
+
+    def _tick_changes_state(self, now: float) -> bool:
+        return self._next_departure(now) != self._shown
+
+    @property
+    def native_value(self):
+        """Voraussichtliche Abfahrtszeit der nächsten Abfahrt."""
+        self._shown = self._next_departure(time.time())
+        if self._shown is None or self._shown.departure_time is None:
+            return None
+        return dt_util.utc_from_timestamp(self._shown.departure_time)
+
+    @property
+    def extra_state_attributes(self):
+        """Wie beim Textsensor, zusätzlich die formatierte Anzeige."""
+        attributes = super().extra_state_attributes
+        attributes["anzeige"] = self._display_text(time.time(), with_countdown=False)
+        return attributes
+
+
+class KVVLineDepartureSensor(KVVDepartureEntity):
+    """Abfahrten einer einzelnen Linie/Richtung eines Entries."""
+
+    def __init__(self, coordinator: KVVDataCoordinator, entry: ConfigEntry, line: dict):
+        super().__init__(coordinator, entry)
+        self._line_key = (line["line_id"], line["dir"])
+        self._attr_name = f"KVV {line['line']} ({line['dir']}) {self._stop_name}"
+        self._attr_unique_id = (
+            f"{entry.entry_id}_departures_{line['line_id']}_{line['dir']}"
+        )
+
+    def _departures(self, now: float | None = None) -> list[Departure]:
+        # Index wird vom Coordinator einmal pro Abruf aufgebaut
+        data = self.coordinator.by_line.get(self._line_key, [])
+        if now is not None:
+            data = [d for d in data if not d.has_departed(now)]
+        limit = self._entry.options.get("departure_limit", DEFAULT_ITEM_LIMIT)
+        return data[:limit]
+
+
+class KVVDelaySensor(CoordinatorEntity, SensorEntity):
+    """Verspätung (Mittel, p90) oder Ausfallquote einer Linie, über die Woche.
+
+    Die Werte der aktuellen Wochenstunde stehen als Attribute daneben.
+    """
+
+    # Art → (Namenszusatz, Einheit)
+    KINDS = {
+        "mean": ("Verspätung Ø", UnitOfTime.MINUTES),
+        "p90": ("Verspätung p90", UnitOfTime.MINUTES),
+        "cancelled": ("Ausfallquote", PERCENTAGE),
+    }
+
+    _attr_state_class = SensorStateClass.MEASUREMENT
+
+    def __init__(
+        self,
+        coordinator: KVVDataCoordinator,
+        entry: ConfigEntry,
+        line: dict | None,
+        kind: str,
+    ):
+        super().__init__(coordinator)
+        self._kind = kind
+        # Zuletzt geschriebene Werte, siehe _stats()
+        self._written: tuple | None = None
+        label, self._attr_native_unit_of_measurement = self.KINDS[kind]
+        stop_name = entry.data.get("stop_name", "Unbekannt")
+        if line is None:
+            self._line_key = None
+            self._attr_name = f"KVV {label} {stop_name}"
+            self._attr_unique_id = f"{entry.entry_id}_delay_{kind}"
+        else:
+            self._line_key = (line["line_id"], line["dir"])
+            self._attr_name = f"KVV {line['line']} ({line['dir']}) {label} {stop_name}"
+            self._attr_unique_id = (
+                f"{entry.entry_id}_delay_{kind}_{line['line_id']}_{line['dir']}"
+            )
+
+    def _summary(self, hour_of_week: int | None = None) -> dict:
+        return self.coordinator.delays.summary(
+            self.coordinator.station_id, self._line_key, hour_of_week
+        )
+
+    def _stats(self) -> tuple:
+        """Alles, was in State und Attribute eingeht."""
+        return self.native_value, tuple(self.extra_state_attributes.values())
+
+    @callback
+    def _handle_coordinator_update(self) -> None:
+        # Die Statistik ändert sich nur, wenn Abfahrten erfasst wurden
+        stats = self._stats()
+        if stats != self._written:
+            self._written = stats
+            self.async_write_ha_state()
+
+    @property
+    def native_value(self):
+        return self._summary()[self._kind]
+
+    @property
+    def extra_state_attributes(self):
+        """Stichprobengröße und Werte der aktuellen Wochenstunde."""
+        now = dt_util.now()
+        current = self._summary(now.weekday() * 24 + now.hour)
+        return {
+            "samples": self._summary()["samples"],
+            "aktuelle_stunde": current[self._kind],
+            "aktuelle_stunde_samples": current["samples"],
+        }
+
+
+class KVVJourneySensor(SensorEntity):
+    """Nächste erreichbare Abfahrten einer Verbindung über mehrere Haltestellen.
+
+    Liest die Coordinators der Haltestellen-Entries, ohne eigene Abrufe.
+    Nach einem Reload eines Haltestellen-Entries wird beim nächsten Tick
+    der neue Coordinator abonniert.
+    """
+
+    _attr_should_poll = False
+    _unrecorded_attributes = frozenset({"abfahrten"})
+
+    def __init__(self, entry: ConfigEntry):
+        self._entry = entry
+        self._attr_name = f"KVV {entry.data.get('name', entry.title)}"
+        self._attr_unique_id = f"{entry.entry_id}_journey"
+        # entry_id → (Coordinator, Abmeldefunktion)
+        self._subscriptions: dict[str, tuple[KVVDataCoordinator, CALLBACK_TYPE]] = {}
+
+    async def async_added_to_hass(self) -> None:
+        """Abonniert die Haltestellen und startet den minütlichen Countdown."""
+        self._async_subscribe()
+        self.async_on_remove(self._async_unsubscribe_all)
+        self.async_on_remove(
+            async_track_time_change(self.hass, self._async_tick, second=0)
+        )
+
+    def _station_entries(self) -> dict[str, ConfigEntry]:
+        domain_data = self.hass.data[DOMAIN]
+        entries = {}
+        for member in self._entry.data.get("members", []):
+            station_entry = self.hass.config_entries.async_get_entry(member["entry_id"])
+            if station_entry is not None and "coordinator" in domain_data.get(
+                member["entry_id"], {}
+            ):
+                entries[member["entry_id"]] = station_entry
+        return entries
+
+    @callback
+    def _async_subscribe(self) -> None:
+        """Meldet sich bei neuen oder ausgetauschten Coordinators an."""
+        domain_data = self.hass.data[DOMAIN]
+        for entry_id in self._station_entries():
+            coordinator = domain_data[entry_id]["coordinator"]
+            current = self._subscriptions.get(entry_id)
+            if current is not None and current[0] is coordinator:
+                continue
+            if current is not None:
+                current[1]()
+            self._subscriptions[entry_id] = (
+                coordinator,
+                coordinator.async_add_listener(self._handle_member_update),
+            )
+
+    @callback
+    def _async_unsubscribe_all(self) -> None:
+        for _, unsubscribe in self._subscriptions.values():
+            unsubscribe()
+        self._subscriptions.clear()
+
+    @callback
+    def _handle_member_update(self) -> None:
+        self.async_write_ha_state()
+
+    async def _async_tick(self, _now) -> None:
+        self._async_subscribe()
+        self.async_write_ha_state()
+
+    def _reachable(self, now: float) -> list[tuple[JourneyStop, Departure]]:
+        station_entries = self._station_entries()
+        domain_data = self.hass.data[DOMAIN]
+        streams = [
+            (
+                stop,
+                # Ohne das Limit der Haltestelle: die Gehzeit filtert erst danach
+                domain_data[stop.entry_id]["coordinator"].departures_for(
+                    station_entries[stop.entry_id], now, limited=False
+                ),
+            )
+            for stop in journey_stops(self._entry, station_entries)
+        ]
+        limit = self._entry.options.get("departure_limit", DEFAULT_ITEM_LIMIT)
+        return merge_reachable(streams, now, limit)
+
+    @property
+    def native_value(self):
+        """Nächste erreichbare Abfahrt mit Haltestelle."""
+        now = time.time()
+        reachable = self._reachable(now)
+        if not reachable:
+            return "Keine Daten"
+        stop, departure = reachable[0]
+        dt = departure.planned_datetime
+        clock = f"{dt:%H:%M}" if dt else "??:??"
+        return (
+            f"{departure.line} → {departure.direction} ab {stop.stop_name} "
+            f"{clock} in {departure.countdown_at(now)} Min"
+        )
+
+    @property
+    def extra_state_attributes(self):
+        """Erreichbare Abfahrten mit Haltestelle, Gehzeit und Losgehzeit."""
+        now = time.time()
+        return {
+            "abfahrten": [
+                {
+                    **departure.as_dict(now),
+                    "stop": stop.stop_name,
+                    "walk_minutes": stop.walk_minutes,
+                    "leave_in": departure.countdown_at(now) - stop.walk_minutes,
+                }
+                for stop, departure in self._reachable(now)
+            ]
+        }
+
+
+class KVVRefreshDurationSensor(SensorEntity):
+    """Diagnosesensor: Dauer der Abrufzyklen der Haltestelle (Median)."""
+
+    _attr_entity_category = EntityCategory.DIAGNOSTIC
+    _attr_entity_registry_enabled_default = False
+    _attr_device_class = SensorDeviceClass.DURATION
+    _attr_state_class = SensorStateClass.MEASUREMENT
+    _attr_native_unit_of_measurement = UnitOfTime.MILLISECONDS
+
+    def __init__(self, coordinator: KVVDataCoordinator, entry: ConfigEntry):
+        self._coordinator = coordinator
+        self._attr_name = f"KVV Abrufdauer {entry.data.get('stop_name', 'Unbekannt')}"
+        self._attr_unique_id = f"{entry.entry_id}_refresh_duration"
+
+    @property
+    def native_value(self):
+        """Median der letzten Zyklusdauern in Millisekunden."""
+        cycle = self._coordinator.metrics.summary(self._coordinator.metrics_scope).get(
+            "cycle_ms", {}
+        )
+        return cycle.get("p50")
+
+    @property
+    def extra_state_attributes(self):
+        """Alle Messgrößen der Haltestelle."""
+        return self._coordinator.metrics.summary(self._coordinator.metrics_scope)
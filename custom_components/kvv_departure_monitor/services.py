@@ -0,0 +1,170 @@
+"""Dienst get_departures: Abfahrten mit eigenem Filter, Zeitpunkt und Limit.
+
+Beantwortet wird bevorzugt aus den Daten des laufenden Coordinators der
+Haltestelle; nur wenn diese die Abfrage nicht abdecken, wird die KVV-API
+gefragt. Antworten werden SERVICE_CACHE_TTL Sekunden gemerkt.
+"""
+
+import time
+from datetime import datetime
+import voluptuous as vol
+import homeassistant.helpers.config_validation as cv
+from homeassistant.core import (
+    HomeAssistant,
+    ServiceCall,
+    ServiceResponse,
+    SupportsResponse,
+)
+from homeassistant.exceptions import HomeAssistantError
+from homeassistant.util import dt as dt_util
+from .api import get_api
+from .catalog import async_get_catalog
+from .models import Departure
+from .const import (
+    DOMAIN,
+    DEFAULT_ITEM_LIMIT,
+    MAX_UPSTREAM_LIMIT,
+    API_CACHE_SIZE,
+    SERVICE_CACHE_TTL,
+)
+
+SERVICE_GET_DEPARTURES = "get_departures"
+
+GET_DEPARTURES_SCHEMA = vol.Schema(
+    {
+        vol.Required("station_id"): cv.string,
+        vol.Optional("lines"): vol.All(cv.ensure_list, [cv.string]),
+        vol.Optional("time"): cv.datetime,
+        vol.Optional("limit", default=DEFAULT_ITEM_LIMIT): vol.All(
+            vol.Coerce(int), vol.Range(min=1, max=MAX_UPSTREAM_LIMIT)
+        ),
+    }
+)
+
+
+def async_setup_services(hass: HomeAssistant) -> None:
+    """Registriert die Dienste der Integration."""
+
+    async def _async_get_departures(call: ServiceCall) -> ServiceResponse:
+        return await async_get_departures(
+            hass,
+            call.data["station_id"],
+            call.data.get("lines"),
+            call.data.get("time"),
+            call.data["limit"],
+        )
+
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_GET_DEPARTURES,
+        _async_get_departures,
+        schema=GET_DEPARTURES_SCHEMA,
+        supports_response=SupportsResponse.ONLY,
+    )
+
+
+async def async_get_departures(
+    hass: HomeAssistant,
+    station_id: str,
+    lines: list[str] | None,
+    when: datetime | None,
+    limit: int,
+) -> dict:
+    """Abfahrten einer Haltestelle ab ``when`` (sonst jetzt).
+
+    ``lines`` enthält Liniennummern ("S4") oder Linien-IDs und gilt für
+    beide Richtungen.
+    """
+    start = dt_util.as_utc(when).timestamp() if when is not None else None
+    # Auf die Minute gerundet, wie die EFA den Zeitpunkt auch versteht
+    key = (
+        station_id,
+        frozenset(lines or ()),
+        None if start is None else int(start // 60),
+        limit,
+    )
+    cache: dict[tuple, tuple[float, list[Departure]]] = hass.data.setdefault(
+        DOMAIN, {}
+    ).setdefault("service_cache", {})
+    now = time.time()
+    cached = cache.get(key)
+    if cached is not None and now - cached[0] < SERVICE_CACHE_TTL:
+        departures = cached[1]
+    else:
+        departures = await _async_query(hass, station_id, lines, start, limit)
+        _remember(cache, key, now, departures)
+
+    return {
+        "station_id": station_id,
+        "departures": [
+            d.as_dict(now)
+            for d in departures
+            if start is not None or not d.has_departed(now)
+        ],
+    }
+
+
+def _remember(cache: dict, key: tuple, now: float, departures: list) -> None:
+    """Merkt eine Antwort; Abgelaufenes und Überzähliges fliegt raus."""
+    for old_key in [k for k, (t, _) in cache.items() if now - t >= SERVICE_CACHE_TTL]:
+        del cache[old_key]
+    cache.pop(key, None)
+    cache[key] = (now, departures)
+    while len(cache) > API_CACHE_SIZE:
+        cache.pop(next(iter(cache)))
+
+
+async def _async_resolve_lines(
+    hass: HomeAssistant, station_id: str, lines: list[str] | None
+) -> list[dict] | None:
+    """Liniennummern → Linien (ID und Richtung) der Haltestelle aus dem Katalog."""
+    if not lines:
+        return None
+    wanted = {line.casefold() for line in lines}
+    try:
+        catalog = await async_get_catalog(hass)
+        serving_lines = await catalog.async_get_serving_lines(station_id)
+    except Exception as e:
+        raise HomeAssistantError(
+            f"Linien der Haltestelle {station_id} nicht verfügbar: {e}"
+        ) from e
+    return [
+        line
+        for line in serving_lines
+        if line["line"].casefold() in wanted or line["line_id"] in wanted
+    ]
+
+
+async def _async_query(
+    hass: HomeAssistant,
+    station_id: str,
+    lines: list[str] | None,
+    start: float | None,
+    limit: int,
+) -> list[Departure]:
+    """Aus dem Coordinator, wenn dessen Daten reichen, sonst von der API."""
+    allowed_lines = await _async_resolve_lines(hass, station_id, lines)
+    if allowed_lines is not None and not allowed_lines:
+        # Keine der Linien hält hier
+        return []
+    line_keys = None
+    if allowed_lines is not None:
+        line_keys = frozenset((l["line_id"], l["dir"]) for l in allowed_lines)
+
+    coordinator = hass.data[DOMAIN].get("stations", {}).get(station_id)
+    if coordinator is not None:
+        departures = coordinator.query(line_keys, start, limit)
+        if departures is not None:
+            return departures
+
+    try:
+        page = await get_api(hass).get_departure_page(
+            station_id,
+            limit=limit if allowed_lines is None else MAX_UPSTREAM_LIMIT,
+            allowed_lines=allowed_lines,
+            start=start,
+            max_matches=limit,
+        )
+    except Exception as e:
+        raise HomeAssistantError(f"KVV API nicht erreichbar: {e}") from e
+    return page.departures[:limit]
@@ -0,0 +1,91 @@
+"""Letzte bekannte Abfahrten je Haltestelle, gespeichert für den nächsten Start.
+
+Nach einem Neustart zeigen die Sensoren sofort die gespeicherten, noch nicht
+abgefahrenen Abfahrten an, während der erste Abruf im Hintergrund läuft.
+"""
+
+import asyncio
+import time
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.storage import Store
+from .models import Departure
+from .const import DOMAIN, SNAPSHOT_STORAGE_VERSION, SNAPSHOT_SAVE_DELAY
+
+STORAGE_KEY = f"{DOMAIN}.departures"
+
+
+async def async_get_snapshots(hass: HomeAssistant) -> "KVVDepartureSnapshots":
+    """Liefert die gemeinsamen, geladenen Abfahrts-Snapshots."""
+    domain_data = hass.data.setdefault(DOMAIN, {})
+    snapshots = domain_data.get("snapshots")
+    if snapshots is None:
+        snapshots = domain_data["snapshots"] = KVVDepartureSnapshots(hass)
+    await snapshots.async_load()
+    return snapshots
+
+
+class KVVDepartureSnapshots:
+    """station_id → (Abrufzeitpunkt, Abfrage, Abfahrten), versioniert gespeichert."""
+
+    def __init__(self, hass: HomeAssistant):
+        self._store = Store(hass, SNAPSHOT_STORAGE_VERSION, STORAGE_KEY)
+        self._load_task: asyncio.Future | None = None
+        # station_id → {"fetched": ts, "limit": n, "lines": [[ID, Richtung]] | None,
+        #               "departures": [Departure.as_storage()]}
+        self._stations: dict[str, dict] = {}
+
+    async def async_load(self) -> None:
+        """Lädt die Snapshots einmalig aus dem Speicher."""
+        if self._load_task is None:
+            self._load_task = asyncio.ensure_future(self._async_load())
+        await self._load_task
+
+    async def _async_load(self) -> None:
+        data = await self._store.async_load()
+        if data:
+            self._stations.update(data.get("stations", {}))
+
+    def get(
+        self, station_id: str
+    ) -> tuple[float, tuple[int, frozenset | None], list[Departure]] | None:
+        """Abrufzeitpunkt, Abfrage (Limit, Linien) und noch nicht abgefahrene
+        Abfahrten einer Haltestelle."""
+        item = self._stations.get(station_id)
+        if item is None:
+            return None
+        lines = item["lines"]
+        if lines is not None:
+            lines = frozenset(tuple(line) for line in lines)
+        query = item["limit"], lines
+        now = time.time()
+        departures = [Departure.from_storage(d) for d in item["departures"]]
+        return (
+            item["fetched"],
+            query,
+            [d for d in departures if not d.has_departed(now)],
+        )
+
+    def update(
+        self,
+        station_id: str,
+        fetched: float,
+        query: tuple[int, frozenset | None],
+        departures: list[Departure],
+    ) -> None:
+        """Merkt sich den letzten erfolgreichen Abruf, verzögert gespeichert."""
+        limit, lines = query
+        self._stations[station_id] = {
+            "fetched": fetched,
+            "limit": limit,
+            "lines": None if lines is None else [list(line) for line in lines],
+            "departures": [d.as_storage() for d in departures],
+        }
+        self._store.async_delay_save(self._data_to_save, SNAPSHOT_SAVE_DELAY)
+
+    def remove(self, station_id: str) -> None:
+        """Vergisst eine Haltestelle, die kein Entry mehr nutzt."""
+        if self._stations.pop(station_id, None) is not None:
+            self._store.async_delay_save(self._data_to_save, SNAPSHOT_SAVE_DELAY)
+
+    def _data_to_save(self) -> dict:
+        return {"stations": self._stations}
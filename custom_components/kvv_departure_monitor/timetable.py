@@ -0,0 +1,177 @@
+"""Lokal gelernter Fahrplan je Haltestelle, Linie und Richtung.
+
+Aus jeder erfolgreichen Abfahrtsabfrage werden die Planzeiten (dateTime)
+übernommen und je Wochentag als sortierte Liste von Abfahrtsminuten
+gespeichert. Fällt die EFA aus, lassen sich daraus die nächsten planmäßigen
+Abfahrten ohne Netzwerk erzeugen. Feiertage und Fahrplanwechsel kennt der
+Fahrplan nicht; nicht mehr beobachtete Minuten verfallen nach
+TIMETABLE_MAX_AGE_DAYS Tagen.
+"""
+
+import asyncio
+import heapq
+from bisect import bisect_left
+from datetime import date, datetime, timedelta
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.storage import Store
+from .models import EFA_TIMEZONE, Departure
+from .const import (
+    DOMAIN,
+    TIMETABLE_STORAGE_VERSION,
+    TIMETABLE_SAVE_DELAY,
+    TIMETABLE_MAX_AGE_DAYS,
+)
+
+STORAGE_KEY = f"{DOMAIN}.timetable"
+
+
+async def async_get_timetable(hass: HomeAssistant) -> "KVVTimetable":
+    """Liefert den gemeinsamen, geladenen Fahrplan."""
+    domain_data = hass.data.setdefault(DOMAIN, {})
+    timetable = domain_data.get("timetable")
+    if timetable is None:
+        timetable = domain_data["timetable"] = KVVTimetable(hass)
+    await timetable.async_load()
+    return timetable
+
+
+class KVVTimetable:
+    """station_id → "Linien-ID:Richtung" → Abfahrtsminuten je Wochentag."""
+
+    def __init__(self, hass: HomeAssistant):
+        self._store = Store(hass, TIMETABLE_STORAGE_VERSION, STORAGE_KEY)
+        self._load_task: asyncio.Future | None = None
+        # Je Linie: {"line", "line_id", "dir", "direction",
+        #            "minutes": 7 sortierte Listen, "seen": 7 Listen Tagesnummern}
+        self._stations: dict[str, dict[str, dict]] = {}
+        self._expired_day = 0
+
+    async def async_load(self) -> None:
+        """Lädt den Fahrplan einmalig aus dem Speicher."""
+        if self._load_task is None:
+            self._load_task = asyncio.ensure_future(self._async_load())
+        await self._load_task
+
+    async def _async_load(self) -> None:
+        data = await self._store.async_load()
+        if data:
+            self._stations.update(data.get("stations", {}))
+            self._expire(datetime.now(EFA_TIMEZONE).toordinal())
+
+    def _data_to_save(self) -> dict:
+        return {"stations": self._stations}
+
+    def learn(self, station_id: str, departures: list[Departure]) -> None:
+        """Übernimmt die Planzeiten einer Abfrage in den Fahrplan."""
+        lines = self._stations.setdefault(station_id, {})
+        changed = False
+        for departure in departures:
+            if departure.planned is None or departure.line_id is None:
+                continue
+            key = f"{departure.line_id}:{departure.dir_code}"
+            item = lines.get(key)
+            if item is None:
+                item = lines[key] = {
+                    "line": departure.line,
+                    "line_id": departure.line_id,
+                    "dir": departure.dir_code,
+                    "direction": departure.direction,
+                    "minutes": [[] for _ in range(7)],
+                    "seen": [[] for _ in range(7)],
+                }
+            dt = datetime.fromtimestamp(departure.planned, EFA_TIMEZONE)
+            weekday, minute = dt.weekday(), dt.hour * 60 + dt.minute
+            minutes, seen = item["minutes"][weekday], item["seen"][weekday]
+            index = bisect_left(minutes, minute)
+            if index < len(minutes) and minutes[index] == minute:
+                if seen[index] != dt.toordinal():
+                    seen[index] = dt.toordinal()
+                    changed = True
+            else:
+                minutes.insert(index, minute)
+                seen.insert(index, dt.toordinal())
+                changed = True
+        today = datetime.now(EFA_TIMEZONE).toordinal()
+        if today != self._expired_day:
+            self._expire(today)
+            changed = True
+        if changed:
+            self._store.async_delay_save(self._data_to_save, TIMETABLE_SAVE_DELAY)
+
+    def remove(self, station_id: str) -> None:
+        """Vergisst eine Haltestelle, die kein Entry mehr nutzt."""
+        if self._stations.pop(station_id, None) is not None:
+            self._store.async_delay_save(self._data_to_save, TIMETABLE_SAVE_DELAY)
+
+    def _expire(self, today: int) -> None:
+        """Entfernt Minuten, die seit TIMETABLE_MAX_AGE_DAYS nicht mehr vorkamen."""
+        self._expired_day = today
+        oldest = today - TIMETABLE_MAX_AGE_DAYS
+        for lines in self._stations.values():
+            for item in lines.values():
+                for weekday in range(7):
+                    kept = [
+                        (m, s)
+                        for m, s in zip(item["minutes"][weekday], item["seen"][weekday])
+                        if s >= oldest
+                    ]
+                    item["minutes"][weekday] = [m for m, _ in kept]
+                    item["seen"][weekday] = [s for _, s in kept]
+
+    def scheduled(
+        self,
+        station_id: str,
+        start: float,
+        limit: int,
+        allowed: set[tuple] | None = None,
+        days: int = 2,
+    ) -> list[Departure]:
+        """Die nächsten ``limit`` Planabfahrten ab ``start``, ohne Echtzeit.
+
+        Durchsucht höchstens ``days`` Betriebstage; mit ``allowed`` nur die
+        Linien mit diesen (Linien-ID, Richtung).
+        """
+        lines = [
+            item
+            for item in self._stations.get(station_id, {}).values()
+            if allowed is None or (item["line_id"], item["dir"]) in allowed
+        ]
+        first = datetime.fromtimestamp(start, EFA_TIMEZONE)
+        departures: list[Departure] = []
+        for offset in range(days):
+            day = first.date() + timedelta(days=offset)
+            from_minute = first.hour * 60 + first.minute if offset == 0 else 0
+            streams = [
+                self._day_departures(item, day, from_minute)
+                for item in lines
+                if item["minutes"][day.weekday()]
+            ]
+            for departure in heapq.merge(*streams, key=lambda d: d.planned):
+                departures.append(departure)
+                if len(departures) >= limit:
+                    return departures
+        return departures
+
+    @staticmethod
+    def _day_departures(item: dict, day: date, from_minute: int):
+        """Planabfahrten einer Linie an einem Tag ab ``from_minute``, aufsteigend."""
+        minutes = item["minutes"][day.weekday()]
+        for minute in minutes[bisect_left(minutes, from_minute) :]:
+            planned = datetime(
+                day.year,
+                day.month,
+                day.day,
+                minute // 60,
+                minute % 60,
+                tzinfo=EFA_TIMEZONE,
+            ).timestamp()
+            yield Departure(
+                line=item["line"],
+                line_id=item["line_id"],
+                dir_code=item["dir"],
+                direction=item["direction"],
+                countdown=None,
+                realtime=False,
+                planned=planned,
+                actual=None,
+            )
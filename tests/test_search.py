@@ -0,0 +1,59 @@
+"""Tests für den lokalen Haltestellen-Suchindex."""
+
+import importlib.util
+from pathlib import Path
+
+# search.py direkt laden, ohne das Paket (und damit Home Assistant) zu importieren
+_PATH = (
+    Path(__file__).resolve().parent.parent
+    / "custom_components"
+    / "kvv_departure_monitor"
+    / "search.py"
+)
+_SPEC = importlib.util.spec_from_file_location("kvv_search", _PATH)
+search = importlib.util.module_from_spec(_SPEC)
+_SPEC.loader.exec_module(search)
+
+
+def _index() -> "search.StationIndex":
+    index = search.StationIndex()
+    index.add(
+        [
+            {"name": "Karlsruhe, Hauptbahnhof", "id": "7000090"},
+            {"name": "Karlsruhe, Marktplatz", "id": "7000001"},
+        ]
+    )
+    return index
+
+
+def _ids(results: list[dict]) -> list[str]:
+    return [point["id"] for point in results]
+
+
+def test_normalize():
+    assert search.normalize("Karlsruhe, Marktplatz (U)") == "karlsruhe marktplatz u"
+    assert search.normalize("Weißenburger Straße") == "weissenburger strasse"
+
+
+def test_prefix_search():
+    index = _index()
+    assert _ids(index.search("Karlsruhe Markt")) == ["7000001"]
+    assert _ids(index.search("hauptb")) == ["7000090"]
+    # Beide bekannten Haltestellen, andere kennt der Index nicht
+    assert sorted(_ids(index.search("Karlsruhe"))) == ["7000001", "7000090"]
+
+
+def test_fuzzy_search_tolerates_typos():
+    assert _ids(_index().search("Karlsruhe Marktplaz")) == ["7000001"]
+
+
+def test_fuzzy_search_ignores_shared_words():
+    # Gemeinsame Wörter ("karlsruhe", "...platz") sind kein Treffer für
+    # unbekannte Haltestellen; diese muss der Stopfinder liefern
+    index = _index()
+    assert index.search("Karlsruhe Europaplatz") == []
+    assert index.search("Karlsruhe Kronenplatz") == []
+
+
+def test_empty_query():
+    assert _index().search("  ,  ") == []